@@ -15,9 +15,23 @@
 
 """Unit tests for QSAN common utilities."""
 
+import gzip
+import os
+import re
 from unittest import mock
 
+import ddt
+from oslo_serialization import jsonutils
+from oslo_utils import strutils
 import requests
+from requests.exceptions import ConnectionError as ReqConnError
+from requests.exceptions import HTTPError
+from requests.exceptions import RequestException
+from requests_mock.contrib import fixture as requests_mock_fixture
+import testtools
+import urllib3
+from urllib3 import exceptions as urllib3_exceptions
+from urllib3.util import retry as urllib3_retry
 
 from cinder.tests.unit import test
 from cinder.volume.drivers.qsan import common
@@ -39,10 +53,123 @@ FAKE_TARGET_IQN = 'iqn.2004-08.com.qsan:target-fake-id'
 FAKE_LUN_ID = 0
 FAKE_INITIATOR_IQN = 'iqn.1993-08.org.debian:01:604af6a341'
 
-
+# Set QSAN_FAST_TESTS=1 to skip tests whose behaviour is already covered by
+# the table-driven or transport-level tests below.
+_FAST = strutils.bool_from_string(os.environ.get('QSAN_FAST_TESTS'))
+
+_CONTENT_TEST = b'{"data": "test"}'
+_CONTENT_EMPTY = b''
+
+
+class _FakeResponse(object):
+    """Minimal stand-in for requests.Response as consumed by QSANClient."""
+
+    __slots__ = ('status_code', 'content', '_json', '_error')
+
+    def __init__(self, status_code=200, json_data=None):
+        self.status_code = status_code
+        self.content = _CONTENT_TEST if json_data else _CONTENT_EMPTY
+        self._json = json_data or {}
+        # Built once so retried calls re-raise the same instance.
+        self._error = (HTTPError(response=self)
+                       if status_code >= 400 else None)
+
+    def json(self):
+        return self._json
+
+    def raise_for_status(self):
+        if self._error is not None:
+            raise self._error
+
+
+def _mock_response(status_code=200, json_data=None):
+    """Create a fake response object."""
+    return _FakeResponse(status_code, json_data)
+
+
+_CONN_ERROR = ReqConnError('Connection failed')
+
+
+# "<METHOD> <URL>" patterns for the requests issued by QSANClient, compiled
+# once at import time.
+_ENDPOINT_RX = {
+    'volume_create': re.compile(r'^POST .*/storage/block/volumes$'),
+    'volume_delete': re.compile(
+        rf'^DELETE .*/volumes/{re.escape(FAKE_VOLUME_NAME)}$'),
+    'volume_extend': re.compile(
+        rf'^PATCH .*/volumes/{re.escape(FAKE_VOLUME_NAME)}$'),
+    'volume_clone': re.compile(
+        rf'^POST .*/volumes/{re.escape(FAKE_VOLUME_NAME)}/clone$'),
+    'snapshot_create': re.compile(
+        rf'^POST .*/targets/{re.escape(FAKE_VOLUME_NAME)}/snapshots$'),
+    'snapshot_delete': re.compile(
+        rf'^DELETE .*/snapshots/{re.escape(FAKE_SNAPSHOT_NAME)}$'),
+    'target_delete': re.compile(
+        rf'^DELETE .*/dataTransfer/targets/{re.escape(FAKE_TARGET_ID)}$'),
+    'target_chap': re.compile(
+        rf'^PUT .*/targets/{re.escape(FAKE_TARGET_ID)}/CHAP$'),
+    'target_host': re.compile(
+        rf'^PUT .*/targets/{re.escape(FAKE_TARGET_ID)}/host$'),
+    'lun_unmap': re.compile(
+        rf'^DELETE .*/targets/{re.escape(FAKE_TARGET_ID)}/luns/'
+        rf'{FAKE_LUN_ID}$'),
+}
+
+
+# Canned replies for the transport-level tests, keyed by (method, path).
+# Registered on the fake adapter once per test so every happy-path call is
+# answered by a plain dictionary lookup.
+_REPLAY_RESPONSES = {
+    ('POST', '/auth/get'): {'token': FAKE_TOKEN},
+    ('POST', '/auth/revoke'): {},
+    ('GET', '/rest/v2/storage/block/volumes/' + FAKE_VOLUME_NAME): {
+        'id': 'vol-001', 'name': FAKE_VOLUME_NAME},
+    ('GET', '/rest/v2/storage/pools/' + FAKE_POOL_NAME): {
+        'name': FAKE_POOL_NAME,
+        'totalSize': 1099511627776,
+        'freeSize': 549755813888,
+        'usedSize': 549755813888},
+    ('GET', '/rest/v2/system/info'): {'version': '5.0.0'},
+    ('GET', '/rest/v2/network/ethernet'): [
+        {'ipv4': {'ip': '192.168.1.101'}, 'online': True},
+        {'ipv4': {'ip': '192.168.1.102'}, 'online': False}],
+    ('POST', '/rest/v2/dataTransfer/targets'): {
+        'id': FAKE_TARGET_ID, 'iqn': FAKE_TARGET_IQN},
+    ('POST', f'/rest/v2/dataTransfer/targets/{FAKE_TARGET_ID}/luns'): {
+        'lun_id': FAKE_LUN_ID},
+}
+
+
+@ddt.ddt
 class QSANClientTestCase(test.TestCase):
     """Test cases for QSANClient."""
 
+    @classmethod
+    def setUpClass(cls):
+        super(QSANClientTestCase, cls).setUpClass()
+        # _FakeResponse holds no call state, so responses of the same
+        # shape are built once and shared by every test in the class.
+        cls.resp_ok = _mock_response()
+        cls.resp_volume = _mock_response(
+            200, {'id': 'vol-001', 'name': FAKE_VOLUME_NAME})
+        cls.resp_new_volume = _mock_response(
+            200, {'id': 'vol-002', 'name': 'new-volume'})
+        cls.resp_pool = _mock_response(
+            200, {
+                'name': FAKE_POOL_NAME,
+                'total_capacity': 1099511627776,  # 1 TB
+                'free_capacity': 549755813888,    # 512 GB
+                'used_capacity': 549755813888,
+            })
+        cls.resp_target = _mock_response(
+            200, {'id': FAKE_TARGET_ID, 'iqn': FAKE_TARGET_IQN})
+        cls.resp_system = _mock_response(
+            200, {
+                'version': '5.0.0',
+                'model': 'XCubeSAN',
+                'iscsi_iqn_prefix': 'iqn.2004-08.com.qsan',
+            })
+
     def setUp(self):
         super(QSANClientTestCase, self).setUp()
         self.client = common.QSANClient(
@@ -54,280 +181,374 @@ class QSANClientTestCase(test.TestCase):
             ssl_verify=False,
             timeout=60,
             retry_count=3,
+            breaker_threshold=2,
         )
+        self.mock_session = mock.Mock(spec=requests.Session, headers={})
+        self.client.session = self.mock_session
+        self.client.session_token = FAKE_TOKEN
 
-    def _mock_response(self, status_code=200, json_data=None):
-        """Create a mock response object."""
-        mock_resp = mock.Mock()
-        mock_resp.status_code = status_code
-        mock_resp.content = b'{"data": "test"}' if json_data else b''
-        mock_resp.json.return_value = json_data or {}
-        mock_resp.raise_for_status = mock.Mock()
-        if status_code >= 400:
-            mock_resp.raise_for_status.side_effect = (
-                requests.exceptions.HTTPError())
-        return mock_resp
+    def _assert_request(self, endpoint):
+        """Assert the last request matched the given _ENDPOINT_RX entry."""
+        args = self.mock_session.request.call_args.args
+        self.assertRegex(f'{args[0]} {args[1]}', _ENDPOINT_RX[endpoint])
 
     # ========== Authentication Tests ==========
 
-    @mock.patch('requests.Session')
+    @mock.patch('cinder.volume.drivers.qsan.common.requests.Session',
+                autospec=True)
     def test_login_success(self, mock_session_class):
         """Test successful login."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.post.return_value = self._mock_response(
+        self.client.session = None
+        mock_session = mock_session_class.return_value
+        mock_session.headers = {}
+        mock_session.post.return_value = _mock_response(
             200, {'token': FAKE_TOKEN})
 
         self.client.login()
 
+        mock_session_class.assert_called_once_with()
         self.assertEqual(FAKE_TOKEN, self.client.session_token)
-        mock_session.post.assert_called_once()
-
-    @mock.patch('requests.Session')
+        self.assertEqual(1, mock_session.post.call_count)
+        self.assertEqual(f'Bearer {FAKE_TOKEN}',
+                         mock_session.headers['Authorization'])
+        self.assertEqual((5, 60),
+                         mock_session.post.call_args.kwargs['timeout'])
+
+    @mock.patch('cinder.volume.drivers.qsan.common.requests.Session',
+                autospec=True)
     def test_login_failure(self, mock_session_class):
         """Test login failure."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.post.side_effect = requests.exceptions.RequestException(
-            'Connection failed')
+        self.client.session = None
+        mock_session_class.return_value.headers = {}
+        mock_session_class.return_value.post.side_effect = (
+            RequestException('Connection failed'))
 
         self.assertRaises(common.QSANApiException, self.client.login)
 
-    @mock.patch('requests.Session')
-    def test_logout_success(self, mock_session_class):
+    def test_create_session(self):
+        """Test the session is pooled and carries the JSON header."""
+        self.client._create_session()
+        session = self.client.session
+
+        self.assertFalse(session.verify)
+        self.assertEqual('application/json', session.headers['Content-Type'])
+        for prefix in ('https://', 'http://'):
+            adapter = session.get_adapter(prefix + FAKE_HOST)
+            self.assertEqual(common._POOL_MAXSIZE, adapter._pool_maxsize)
+            self.assertEqual(common._POOL_CONNECTIONS,
+                             adapter._pool_connections)
+            self.assertEqual(
+                common._SOCKET_OPTIONS,
+                adapter.poolmanager.connection_pool_kw['socket_options'])
+
+    def test_create_session_bulkheads(self):
+        """Test each endpoint family gets a pool of its own."""
+        self.client._create_session()
+        session = self.client.session
+        default = session.get_adapter(self.client.base_url)
+
+        adapters = set()
+        for key, pool_maxsize in common._POOL_BULKHEADS:
+            adapter = session.get_adapter(self.client._urls[key] + '/x')
+            self.assertIsNot(default, adapter)
+            self.assertEqual(pool_maxsize, adapter._pool_maxsize)
+            adapters.add(adapter)
+        self.assertEqual(len(common._POOL_BULKHEADS), len(adapters))
+        self.assertIs(default,
+                      session.get_adapter(self.client._urls['pools']))
+
+    def test_create_session_pool_maxsize(self):
+        """Test the configured pool size caps every pool."""
+        self.client.pool_maxsize = 8
+        self.client._create_session()
+        session = self.client.session
+
+        self.assertEqual(8, session.get_adapter(
+            self.client.base_url)._pool_maxsize)
+        self.assertEqual(8, session.get_adapter(
+            self.client._urls['volumes'])._pool_maxsize)
+        self.assertEqual(4, session.get_adapter(
+            self.client._urls['system'])._pool_maxsize)
+
+    def test_logout_success(self):
         """Test successful logout."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(200)
-
-        # Setup session first
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        self.mock_session.request.return_value = self.resp_ok
+        self.mock_session.headers['Authorization'] = f'Bearer {FAKE_TOKEN}'
 
         self.client.logout()
 
         self.assertIsNone(self.client.session_token)
-        self.assertIsNone(self.client.session)
+        self.assertIs(self.mock_session, self.client.session)
+        self.assertNotIn('Authorization', self.mock_session.headers)
 
     def test_logout_no_session(self):
         """Test logout when no session exists."""
+        self.client.session = None
         # Should not raise any exception
         self.client.logout()
 
-    # ========== Volume Operations Tests ==========
-
-    @mock.patch('requests.Session')
-    def test_create_volume(self, mock_session_class):
-        """Test create volume."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(
-            200, {'id': 'vol-001', 'name': FAKE_VOLUME_NAME})
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
-
-        result = self.client.create_volume(FAKE_POOL_NAME, FAKE_VOLUME_NAME, 10)
-
-        self.assertIsNotNone(result)
-        mock_session.request.assert_called_once()
-        call_args = mock_session.request.call_args
-        self.assertEqual('POST', call_args[0][0])
-        self.assertIn('volumes', call_args[0][1])
-
-    @mock.patch('requests.Session')
-    def test_delete_volume(self, mock_session_class):
-        """Test delete volume."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(200)
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
-
-        self.client.delete_volume(FAKE_VOLUME_NAME)
+    def test_close(self):
+        """Test close logs out and closes the session."""
+        self.mock_session.request.return_value = self.resp_ok
 
-        mock_session.request.assert_called_once()
-        call_args = mock_session.request.call_args
-        self.assertEqual('DELETE', call_args[0][0])
-        self.assertIn(FAKE_VOLUME_NAME, call_args[0][1])
+        self.client.close()
 
-    @mock.patch('requests.Session')
-    def test_extend_volume(self, mock_session_class):
-        """Test extend volume."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(200)
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
-
-        self.client.extend_volume(FAKE_VOLUME_NAME, 20)
+        self.assertIsNone(self.client.session_token)
+        self.assertIsNone(self.client.session)
+        self.assertEqual(1, self.mock_session.request.call_count)
+        self.assertEqual(1, self.mock_session.close.call_count)
+
+    def test_context_manager(self):
+        """Test the client logs in on entry and closes on exit."""
+        with mock.patch.object(self.client, 'login') as mock_login, \
+                mock.patch.object(self.client, 'close') as mock_close:
+            with self.client as client:
+                self.assertIs(self.client, client)
+                mock_login.assert_called_once_with()
+                mock_close.assert_not_called()
+
+        mock_close.assert_called_once_with()
+
+    # ========== Request Verb/URL Tests ==========
+
+    @ddt.data(
+        ('create_volume', (FAKE_POOL_NAME, FAKE_VOLUME_NAME, 10),
+         'volume_create'),
+        ('delete_volume', (FAKE_VOLUME_NAME,), 'volume_delete'),
+        ('extend_volume', (FAKE_VOLUME_NAME, 20), 'volume_extend'),
+        ('create_snapshot', (FAKE_VOLUME_NAME, FAKE_SNAPSHOT_NAME),
+         'snapshot_create'),
+        ('delete_snapshot', (FAKE_VOLUME_NAME, FAKE_SNAPSHOT_NAME),
+         'snapshot_delete'),
+        ('clone_volume', (FAKE_VOLUME_NAME, 'new-volume'), 'volume_clone'),
+        ('delete_iscsi_target', (FAKE_TARGET_ID,), 'target_delete'),
+        ('unmap_volume_from_target', (FAKE_TARGET_ID, FAKE_LUN_ID),
+         'lun_unmap'),
+        ('add_initiator_to_target', (FAKE_TARGET_ID, FAKE_INITIATOR_IQN),
+         'target_host'),
+        ('set_target_chap', (FAKE_TARGET_ID, 'chap_user', 'chap_pass'),
+         'target_chap'),
+    )
+    @ddt.unpack
+    def test_request_verb_and_url(self, method, args, endpoint):
+        """Test client methods issue the expected HTTP verb and URL."""
+        self.mock_session.request.return_value = self.resp_ok
+
+        getattr(self.client, method)(*args)
+
+        self.assertEqual(1, self.mock_session.request.call_count)
+        self._assert_request(endpoint)
 
-        mock_session.request.assert_called_once()
-        call_args = mock_session.request.call_args
-        self.assertEqual('PUT', call_args[0][0])
+    # ========== Volume Operations Tests ==========
 
-    @mock.patch('requests.Session')
-    def test_get_volume(self, mock_session_class):
+    def test_get_volume(self):
         """Test get volume."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(
-            200, {'id': 'vol-001', 'name': FAKE_VOLUME_NAME})
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        self.mock_session.request.return_value = self.resp_volume
 
         result = self.client.get_volume(FAKE_VOLUME_NAME)
 
         self.assertIsNotNone(result)
         self.assertEqual(FAKE_VOLUME_NAME, result['name'])
+        self.assertEqual(
+            (5, 60), self.mock_session.request.call_args.kwargs['timeout'])
 
-    @mock.patch('requests.Session')
-    def test_get_volume_not_found(self, mock_session_class):
+    def test_get_volume_not_found(self):
         """Test get volume when not found."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.side_effect = requests.exceptions.RequestException(
-            'Not found')
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        self.mock_session.request.side_effect = (
+            RequestException('Not found'))
 
         result = self.client.get_volume(FAKE_VOLUME_NAME)
 
         self.assertIsNone(result)
 
-    # ========== Snapshot Operations Tests ==========
+    @ddt.data((200, True), (404, False))
+    @ddt.unpack
+    def test_delete_volume_if_exists(self, status, expected):
+        """Test a missing volume counts as deleted in a single request."""
+        self.client._cache.set('pool:' + FAKE_POOL_NAME, {}, 60)
+        self.mock_session.request.return_value = _mock_response(status)
 
-    @mock.patch('requests.Session')
-    def test_create_snapshot(self, mock_session_class):
-        """Test create snapshot."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(
-            200, {'id': 'snap-001', 'name': FAKE_SNAPSHOT_NAME})
+        self.assertEqual(expected,
+                         self.client.delete_volume_if_exists(FAKE_VOLUME_NAME))
 
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
-
-        result = self.client.create_snapshot(FAKE_VOLUME_NAME, FAKE_SNAPSHOT_NAME)
-
-        self.assertIsNotNone(result)
-        mock_session.request.assert_called_once()
-        call_args = mock_session.request.call_args
-        self.assertEqual('POST', call_args[0][0])
-        self.assertIn('snapshots', call_args[0][1])
-
-    @mock.patch('requests.Session')
-    def test_delete_snapshot(self, mock_session_class):
-        """Test delete snapshot."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(200)
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        self.assertEqual(1, self.mock_session.request.call_count)
+        self._assert_request('volume_delete')
+        self.assertIs(common._MISSING,
+                      self.client._cache.get('pool:' + FAKE_POOL_NAME))
 
-        self.client.delete_snapshot(FAKE_VOLUME_NAME, FAKE_SNAPSHOT_NAME)
+    def test_delete_if_exists_error(self):
+        """Test errors other than 404 are still raised."""
+        self.mock_session.request.return_value = _mock_response(409)
 
-        mock_session.request.assert_called_once()
-        call_args = mock_session.request.call_args
-        self.assertEqual('DELETE', call_args[0][0])
+        self.assertRaises(common.QSANApiException,
+                          self.client.delete_volume_if_exists,
+                          FAKE_VOLUME_NAME)
 
-    # ========== Clone Operations Tests ==========
+    # ========== Snapshot/Clone Operations Tests ==========
 
-    @mock.patch('requests.Session')
-    def test_clone_volume(self, mock_session_class):
-        """Test clone volume."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(
-            200, {'id': 'vol-002', 'name': 'new-volume'})
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
-
-        result = self.client.clone_volume(FAKE_VOLUME_NAME, 'new-volume')
-
-        self.assertIsNotNone(result)
-        mock_session.request.assert_called_once()
-        call_args = mock_session.request.call_args
-        self.assertEqual('POST', call_args[0][0])
-        self.assertIn('clone', call_args[0][1])
-
-    @mock.patch('requests.Session')
-    def test_create_volume_from_snapshot(self, mock_session_class):
+    def test_create_volume_from_snapshot(self):
         """Test create volume from snapshot."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(
-            200, {'id': 'vol-002', 'name': 'new-volume'})
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        self.mock_session.request.return_value = self.resp_new_volume
 
         result = self.client.create_volume_from_snapshot(
             FAKE_VOLUME_NAME, FAKE_SNAPSHOT_NAME, 'new-volume')
 
         self.assertIsNotNone(result)
 
+    @ddt.data((20480, 1), (10240, 2), (None, 2))
+    @ddt.unpack
+    def test_clone_volume_with_size(self, reported, expected_requests):
+        """Test a clone is extended only if the array ignored its size."""
+        self.mock_session.request.side_effect = [
+            _mock_response(200, {'name': 'new-volume',
+                                 'totalSize': reported}),
+            self.resp_ok]
+
+        self.client.clone_volume(FAKE_VOLUME_NAME, 'new-volume', size_gb=20)
+
+        self.assertEqual(expected_requests,
+                         self.mock_session.request.call_count)
+        clone_call = self.mock_session.request.call_args_list[0]
+        self.assertEqual({'volumeName': 'new-volume', 'totalSize': 20480},
+                         jsonutils.loads(clone_call.kwargs['data']))
+        if expected_requests == 2:
+            self.assertRegex(
+                ' '.join(self.mock_session.request.call_args.args),
+                r'^PATCH .*/volumes/new-volume$')
+
+    def test_clone_volume_size_rejected(self):
+        """Test a clone is retried without its size and then extended."""
+        self.mock_session.request.side_effect = [
+            _mock_response(400), self.resp_new_volume, self.resp_ok]
+
+        self.client.clone_volume(FAKE_VOLUME_NAME, 'new-volume', size_gb=20)
+
+        calls = self.mock_session.request.call_args_list
+        self.assertEqual(3, len(calls))
+        self.assertEqual({'volumeName': 'new-volume'},
+                         jsonutils.loads(calls[1].kwargs['data']))
+        self.assertEqual('PATCH', calls[2].args[0])
+
+    def test_clone_volume_size_other_error(self):
+        """Test a clone that fails for another reason is not retried."""
+        self.mock_session.request.return_value = _mock_response(409)
+
+        self.assertRaises(common.QSANApiException, self.client.clone_volume,
+                          FAKE_VOLUME_NAME, 'new-volume', size_gb=20)
+        self.assertEqual(1, self.mock_session.request.call_count)
+
+    @ddt.data((200, True), (404, False))
+    @ddt.unpack
+    def test_delete_snapshot_if_exists(self, status, expected):
+        """Test a missing snapshot counts as deleted in a single request."""
+        self.mock_session.request.return_value = _mock_response(status)
+
+        self.assertEqual(expected, self.client.delete_snapshot_if_exists(
+            FAKE_VOLUME_NAME, FAKE_SNAPSHOT_NAME))
+
+        self.assertEqual(1, self.mock_session.request.call_count)
+        self._assert_request('snapshot_delete')
+
     # ========== Pool Operations Tests ==========
 
-    @mock.patch('requests.Session')
-    def test_get_pool(self, mock_session_class):
+    def test_get_pool(self):
         """Test get pool."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(
-            200, {
-                'name': FAKE_POOL_NAME,
-                'total_capacity': 1099511627776,  # 1 TB
-                'free_capacity': 549755813888,    # 512 GB
-            })
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        self.mock_session.request.return_value = self.resp_pool
 
         result = self.client.get_pool(FAKE_POOL_NAME)
 
         self.assertIsNotNone(result)
         self.assertEqual(FAKE_POOL_NAME, result['name'])
 
-    @mock.patch('requests.Session')
-    def test_get_pool_stats(self, mock_session_class):
+    def test_get_pool_stats(self):
         """Test get pool stats."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(
-            200, {
-                'name': FAKE_POOL_NAME,
-                'total_capacity': 1099511627776,
-                'free_capacity': 549755813888,
-                'used_capacity': 549755813888,
-            })
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        self.mock_session.request.return_value = self.resp_pool
 
         result = self.client.get_pool_stats(FAKE_POOL_NAME)
 
         self.assertIn('total_capacity', result)
         self.assertIn('free_capacity', result)
 
+    @mock.patch('cinder.volume.drivers.qsan.common.time.monotonic')
+    def test_get_pool_cache_expiry(self, mock_monotonic):
+        """Test pool info is refetched once its TTL has passed."""
+        mock_monotonic.return_value = 100
+        self.mock_session.request.return_value = self.resp_pool
+
+        self.client.get_pool(FAKE_POOL_NAME)
+        mock_monotonic.return_value = 100 + common._POOL_TTL - 1
+        self.client.get_pool(FAKE_POOL_NAME)
+        self.assertEqual(1, self.mock_session.request.call_count)
+
+        mock_monotonic.return_value = 100 + common._POOL_TTL
+        self.client.get_pool(FAKE_POOL_NAME)
+        self.assertEqual(2, self.mock_session.request.call_count)
+
+    def test_get_pool_returns_copy(self):
+        """Test changing a returned pool does not alter the cache."""
+        self.mock_session.request.return_value = self.resp_pool
+
+        self.client.get_pool(FAKE_POOL_NAME)['name'] = 'changed'
+
+        self.assertEqual(FAKE_POOL_NAME,
+                         self.client.get_pool(FAKE_POOL_NAME)['name'])
+        self.assertEqual(1, self.mock_session.request.call_count)
+
+    @mock.patch('cinder.volume.drivers.qsan.common.time.monotonic')
+    def test_get_pool_stats_stale(self, mock_monotonic):
+        """Test the last good pool stats are served while the API fails."""
+        mock_monotonic.return_value = 100
+        self.mock_session.request.return_value = self.resp_pool
+        expected = self.client.get_pool_stats(FAKE_POOL_NAME)
+
+        self.mock_session.request.side_effect = _CONN_ERROR
+        mock_monotonic.return_value = 100 + common._STALE_TTL - 1
+        with self.assertLogs(common.LOG.logger, 'WARNING'):
+            self.assertEqual(expected,
+                             self.client.get_pool_stats(FAKE_POOL_NAME))
+
+        mock_monotonic.return_value = 100 + common._STALE_TTL
+        self.assertRaises(common.QSANApiException,
+                          self.client.get_pool_stats, FAKE_POOL_NAME)
+        self.assertEqual(3, self.mock_session.request.call_count)
+
+    @ddt.data(('create_snapshot', (FAKE_VOLUME_NAME, FAKE_SNAPSHOT_NAME)),
+              ('delete_snapshot', (FAKE_VOLUME_NAME, FAKE_SNAPSHOT_NAME)),
+              ('delete_snapshot_if_exists',
+               (FAKE_VOLUME_NAME, FAKE_SNAPSHOT_NAME)),
+              ('clone_volume', (FAKE_VOLUME_NAME, 'new-volume')),
+              ('create_volume_from_snapshot',
+               (FAKE_VOLUME_NAME, FAKE_SNAPSHOT_NAME, 'new-volume')))
+    @ddt.unpack
+    def test_capacity_change_invalidates_pool(self, method, args):
+        """Test calls that change pool capacity drop the cached pool."""
+        self.client._cache.set('pool:' + FAKE_POOL_NAME, {}, 60)
+        self.mock_session.request.return_value = self.resp_ok
+
+        getattr(self.client, method)(*args)
+
+        self.assertIs(common._MISSING,
+                      self.client._cache.get('pool:' + FAKE_POOL_NAME))
+
+    @ddt.data(('create_volume', (FAKE_POOL_NAME, FAKE_VOLUME_NAME, 10)),
+              ('delete_volume', (FAKE_VOLUME_NAME,)),
+              ('extend_volume', (FAKE_VOLUME_NAME, 20)))
+    @ddt.unpack
+    def test_volume_change_invalidates_pool(self, method, args):
+        """Test volume changes drop the cached pool capacity."""
+        self.mock_session.request.return_value = self.resp_pool
+        self.client.get_pool(FAKE_POOL_NAME)
+
+        getattr(self.client, method)(*args)
+        self.client.get_pool(FAKE_POOL_NAME)
+
+        self.assertEqual(3, self.mock_session.request.call_count)
+
     # ========== iSCSI Operations Tests ==========
 
-    @mock.patch('requests.Session')
-    def test_create_iscsi_target(self, mock_session_class):
+    def test_create_iscsi_target(self):
         """Test create iSCSI target."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(
-            200, {'id': FAKE_TARGET_ID, 'iqn': FAKE_TARGET_IQN})
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        self.mock_session.request.return_value = self.resp_target
 
         result = self.client.create_iscsi_target(FAKE_TARGET_NAME)
 
@@ -335,192 +556,582 @@ class QSANClientTestCase(test.TestCase):
         self.assertEqual(FAKE_TARGET_ID, result['id'])
         self.assertEqual(FAKE_TARGET_IQN, result['iqn'])
 
-    @mock.patch('requests.Session')
-    def test_delete_iscsi_target(self, mock_session_class):
-        """Test delete iSCSI target."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(200)
+    def test_resolve_target_id_cached(self):
+        """Test a target id is listed once and dropped on delete."""
+        self.mock_session.request.return_value = _mock_response(
+            200, [{'id': FAKE_TARGET_ID, 'name': FAKE_TARGET_NAME}])
 
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        self.assertEqual(FAKE_TARGET_ID,
+                         self.client.resolve_target_id(FAKE_TARGET_NAME))
+        self.assertEqual(FAKE_TARGET_ID,
+                         self.client.resolve_target_id(FAKE_TARGET_NAME))
+        self.assertEqual(1, self.mock_session.request.call_count)
 
+        self.mock_session.request.return_value = self.resp_ok
         self.client.delete_iscsi_target(FAKE_TARGET_ID)
-
-        mock_session.request.assert_called_once()
-        call_args = mock_session.request.call_args
-        self.assertEqual('DELETE', call_args[0][0])
-
-    @mock.patch('requests.Session')
-    def test_map_volume_to_target(self, mock_session_class):
+        self.mock_session.request.return_value = _mock_response(
+            200, [{'id': FAKE_TARGET_ID, 'name': FAKE_TARGET_NAME}])
+        self.client.resolve_target_id(FAKE_TARGET_NAME)
+        self.assertEqual(3, self.mock_session.request.call_count)
+
+    def test_resolve_target_id_refresh(self):
+        """Test refresh replaces a cached id with the one listed now."""
+        self.client._target_ids[FAKE_TARGET_NAME] = 'stale-id'
+        self.mock_session.request.return_value = _mock_response(
+            200, [{'id': FAKE_TARGET_ID, 'name': FAKE_TARGET_NAME}])
+
+        self.assertEqual('stale-id',
+                         self.client.resolve_target_id(FAKE_TARGET_NAME))
+        self.assertEqual(FAKE_TARGET_ID, self.client.resolve_target_id(
+            FAKE_TARGET_NAME, refresh=True))
+        self.assertEqual(FAKE_TARGET_ID,
+                         self.client.resolve_target_id(FAKE_TARGET_NAME))
+        self.assertEqual(1, self.mock_session.request.call_count)
+
+    def test_resolve_target_id_not_found(self):
+        """Test a missing target is not cached."""
+        self.mock_session.request.return_value = _mock_response(200, [])
+
+        self.assertIsNone(self.client.resolve_target_id(FAKE_TARGET_NAME))
+        self.assertIsNone(self.client.resolve_target_id(FAKE_TARGET_NAME))
+        self.assertEqual(2, self.mock_session.request.call_count)
+
+    def test_map_volume_to_target(self):
         """Test map volume to target."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(
+        self.mock_session.request.return_value = _mock_response(
             200, {'lun_id': FAKE_LUN_ID})
 
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
-
         result = self.client.map_volume_to_target(
             FAKE_VOLUME_NAME, FAKE_TARGET_ID)
 
         self.assertIsNotNone(result)
         self.assertEqual(FAKE_LUN_ID, result['lun_id'])
 
-    @mock.patch('requests.Session')
-    def test_unmap_volume_from_target(self, mock_session_class):
-        """Test unmap volume from target."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(200)
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
-
-        self.client.unmap_volume_from_target(FAKE_TARGET_ID, FAKE_LUN_ID)
-
-        mock_session.request.assert_called_once()
-
-    @mock.patch('requests.Session')
-    def test_add_initiator_to_target(self, mock_session_class):
+    @testtools.skipIf(_FAST, 'Covered by table-driven tests')
+    def test_add_initiator_to_target(self):
         """Test add initiator to target ACL."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(200)
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        self.mock_session.request.return_value = self.resp_ok
 
         self.client.add_initiator_to_target(FAKE_TARGET_ID, FAKE_INITIATOR_IQN)
 
-        mock_session.request.assert_called_once()
-        call_args = mock_session.request.call_args
-        self.assertEqual('POST', call_args[0][0])
-        self.assertIn('acl', call_args[0][1])
+        self.assertEqual(1, self.mock_session.request.call_count)
+        self._assert_request('target_host')
 
-    @mock.patch('requests.Session')
-    def test_remove_initiator_from_target(self, mock_session_class):
+    def test_remove_initiator_from_target(self):
         """Test remove initiator from target ACL."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(200)
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        self.mock_session.request.return_value = self.resp_ok
 
         self.client.remove_initiator_from_target(
             FAKE_TARGET_ID, FAKE_INITIATOR_IQN)
 
-        mock_session.request.assert_called_once()
-        call_args = mock_session.request.call_args
-        self.assertEqual('DELETE', call_args[0][0])
+        self.assertEqual(1, self.mock_session.request.call_count)
+        self._assert_request('target_host')
+        self.assertEqual(
+            'remove',
+            jsonutils.loads(
+                self.mock_session.request.call_args.kwargs['data'])['action'])
 
-    @mock.patch('requests.Session')
-    def test_set_target_chap(self, mock_session_class):
+    @testtools.skipIf(_FAST, 'Covered by table-driven tests')
+    def test_set_target_chap(self):
         """Test set CHAP authentication for target."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(200)
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        self.mock_session.request.return_value = self.resp_ok
 
         self.client.set_target_chap(FAKE_TARGET_ID, 'chap_user', 'chap_pass')
 
-        mock_session.request.assert_called_once()
+        self.assertEqual(1, self.mock_session.request.call_count)
 
-    @mock.patch('requests.Session')
-    def test_get_iscsi_portals(self, mock_session_class):
+    @testtools.skipIf(_FAST, 'Covered by transport-level tests')
+    def test_get_iscsi_portals(self):
         """Test get iSCSI portals."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(
-            200, {'portals': ['192.168.1.101', '192.168.1.102']})
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        self.mock_session.request.return_value = _mock_response(
+            200, {'data': [
+                {'ipv4': {'ip': '192.168.1.101'}, 'online': True},
+                {'ipv4': {'ip': '192.168.1.102'}, 'online': True},
+                {'ipv4': {'ip': '192.168.1.103'}, 'online': False},
+            ]})
 
         result = self.client.get_iscsi_portals()
 
         self.assertEqual(['192.168.1.101', '192.168.1.102'], result)
 
+    def test_get_iscsi_portals_returns_copy(self):
+        """Test changing the returned portals does not alter the cache."""
+        self.mock_session.request.return_value = _mock_response(
+            200, {'data': [{'ipv4': {'ip': '192.168.1.101'},
+                            'online': True}]})
+
+        self.client.get_iscsi_portals().append('192.168.1.199')
+        self.client.get_iscsi_portals().clear()
+
+        self.assertEqual(['192.168.1.101'], self.client.get_iscsi_portals())
+        self.assertEqual(1, self.mock_session.request.call_count)
+
+    @ddt.data((200, True), (404, False))
+    @ddt.unpack
+    def test_delete_iscsi_target_if_exists(self, status, expected):
+        """Test a missing target counts as deleted and leaves the cache."""
+        self.client._target_ids[FAKE_TARGET_NAME] = FAKE_TARGET_ID
+        self.mock_session.request.return_value = _mock_response(status)
+
+        self.assertEqual(expected, self.client.delete_iscsi_target_if_exists(
+            FAKE_TARGET_ID))
+
+        self.assertEqual(1, self.mock_session.request.call_count)
+        self._assert_request('target_delete')
+        self.assertEqual({}, self.client._target_ids)
+
     # ========== System Operations Tests ==========
 
-    @mock.patch('requests.Session')
-    def test_get_system_info(self, mock_session_class):
+    def test_get_system_info(self):
         """Test get system info."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(
-            200, {
-                'version': '5.0.0',
-                'model': 'XCubeSAN',
-                'iscsi_iqn_prefix': 'iqn.2004-08.com.qsan',
-            })
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        self.mock_session.request.return_value = self.resp_system
 
         result = self.client.get_system_info()
 
         self.assertIsNotNone(result)
         self.assertEqual('5.0.0', result['version'])
 
-    @mock.patch('requests.Session')
-    def test_get_system_version(self, mock_session_class):
+    @testtools.skipIf(_FAST, 'Covered by transport-level tests')
+    def test_get_system_version(self):
         """Test get system version."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.return_value = self._mock_response(
-            200, {'version': '5.0.0'})
-
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        self.mock_session.request.return_value = self.resp_system
 
         result = self.client.get_system_version()
 
         self.assertEqual('5.0.0', result)
 
+    def test_get_system_info_cached(self):
+        """Test system info is fetched once within its TTL."""
+        self.mock_session.request.return_value = self.resp_system
+
+        self.client.get_system_version()
+        self.client.get_iscsi_iqn_prefix()
+
+        self.assertEqual(1, self.mock_session.request.call_count)
+
+    def test_get_system_info_no_stale(self):
+        """Test a failure is raised when nothing was fetched before."""
+        self.mock_session.request.side_effect = _CONN_ERROR
+
+        self.assertRaises(common.QSANApiException,
+                          self.client.get_system_info)
+
     # ========== Error Handling Tests ==========
 
-    @mock.patch('requests.Session')
-    def test_request_retry_on_failure(self, mock_session_class):
-        """Test request retry on transient failure."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
+    @mock.patch('cinder.volume.drivers.qsan.common.jsonutils.dumps',
+                wraps=jsonutils.dumps)
+    def test_request_body_encoded_once(self, mock_dumps):
+        """Test the request body is serialized once across a re-login."""
+        self.mock_session.request.side_effect = iter(
+            [_mock_response(401), self.resp_ok])
+
+        with mock.patch.object(self.client, 'login'):
+            self.client._request('PUT', 'http://test/api/test',
+                                 data={'name': FAKE_VOLUME_NAME})
+
+        mock_dumps.assert_called_once_with({'name': FAKE_VOLUME_NAME})
+        bodies = {c.kwargs['data']
+                  for c in self.mock_session.request.call_args_list}
+        self.assertEqual({f'{{"name": "{FAKE_VOLUME_NAME}"}}'}, bodies)
+
+    def test_request_body_compressed(self):
+        """Test a large body is gzipped when compression is enabled."""
+        self.client.compress_requests = True
+        self.mock_session.request.return_value = self.resp_ok
+        data = {'name': 'x' * common._GZIP_MIN_SIZE}
+
+        self.client._request('POST', 'http://test/api/test', data=data)
+
+        kwargs = self.mock_session.request.call_args.kwargs
+        self.assertEqual({'Content-Encoding': 'gzip'}, kwargs['headers'])
+        self.assertEqual(data, jsonutils.loads(gzip.decompress(
+            kwargs['data'])))
+
+    @ddt.data((False, common._GZIP_MIN_SIZE), (True, 10))
+    @ddt.unpack
+    def test_request_body_not_compressed(self, enabled, size):
+        """Test small bodies, or all with compression off, are sent as-is."""
+        self.client.compress_requests = enabled
+        self.mock_session.request.return_value = self.resp_ok
+        data = {'name': 'x' * size}
+
+        self.client._request('POST', 'http://test/api/test', data=data)
+
+        kwargs = self.mock_session.request.call_args.kwargs
+        self.assertIsNone(kwargs['headers'])
+        self.assertEqual(data, jsonutils.loads(kwargs['data']))
+
+    def test_create_session_retry(self):
+        """Test the session adapter retries transient failures."""
+        self.client._create_session()
+
+        for prefix in ('https://', 'http://'):
+            retry = self.client.session.get_adapter(
+                prefix + FAKE_HOST).max_retries
+            self.assertIsInstance(retry, common._JitteredRetry)
+            self.assertEqual(2, retry.total)
+            self.assertFalse(retry.raise_on_status)
+            self.assertTrue(retry.respect_retry_after_header)
+            self.assertEqual(30, retry.backoff_cap)
+            self.assertEqual(0.5, retry.jitter)
+            self.assertNotIn('POST', retry.allowed_methods)
+
+    def test_retry_post_not_replayed(self):
+        """Test a POST is only retried if it never reached the array."""
+        retry = self.client._build_retry()
+
+        self.assertFalse(retry.is_retry('POST', 503))
+        self.assertRaises(
+            urllib3_exceptions.ReadTimeoutError, retry.increment, 'POST', '/x',
+            error=urllib3_exceptions.ReadTimeoutError(None, '/x', 'timeout'))
+        retry = retry.increment(
+            'POST', '/x',
+            error=urllib3_exceptions.NewConnectionError(None, 'refused'))
+        self.assertEqual(1, retry.total)
+
+    @ddt.data((400, False), (401, False), (404, False), (429, True),
+              (500, True), (503, True))
+    @ddt.unpack
+    def test_retry_by_status(self, status, expected):
+        """Test only throttling and server errors are retried."""
+        retry = self.client._build_retry()
+
+        self.assertEqual(expected, retry.is_retry('GET', status))
+
+    @ddt.data((0, 0, 0), (1, 0, 1.0), (2, 0, 2.0), (3, 1, 6.0),
+              (10, 0, 30.0), (10, 1, 45.0))
+    @ddt.unpack
+    def test_retry_backoff(self, failures, rand, expected):
+        """Test the backoff grows exponentially, capped, plus jitter."""
+        history = (urllib3_retry.RequestHistory('GET', '/x', None, 503,
+                                                None),) * failures
+        retry = self.client._build_retry().new(history=history)
+
+        with mock.patch('cinder.volume.drivers.qsan.common.random.random',
+                        return_value=rand):
+            self.assertEqual(expected, retry.get_backoff_time())
+
+    @ddt.data(('600', 30), ('7', 7), (None, None))
+    @ddt.unpack
+    def test_retry_after_capped(self, header, expected):
+        """Test a server Retry-After is honoured up to the backoff cap."""
+        retry = self.client._build_retry()
+        headers = {} if header is None else {'Retry-After': header}
+        response = urllib3.HTTPResponse(status=503, headers=headers)
+
+        self.assertEqual(expected, retry.get_retry_after(response))
+
+    def test_retry_increment_keeps_backoff(self):
+        """Test the backoff settings survive each retry attempt."""
+        self.client.backoff_cap = 4
+        self.client.jitter = 0
+
+        retry = self.client._build_retry().increment('GET', '/x',
+                                                     error=_CONN_ERROR)
+        retry = retry.increment('GET', '/x', error=_CONN_ERROR)
+
+        self.assertEqual(0, retry.total)
+        self.assertEqual(4, retry.backoff_cap)
+        self.assertEqual(0, retry.jitter)
+
+    def test_request_sent_once(self):
+        """Test a failed request is not re-sent above the adapter."""
+        self.mock_session.request.return_value = _mock_response(503)
+
+        self.assertRaises(common.QSANApiException,
+                          self.client._request, 'GET', 'http://test/api/test')
+
+        self.assertEqual(1, self.mock_session.request.call_count)
+
+    def test_request_breaker_opens(self):
+        """Test calls are rejected unsent once the breaker opens."""
+        self.mock_session.request.side_effect = _CONN_ERROR
+        for _ in range(2):
+            self.assertRaises(common.QSANApiException,
+                              self.client._request, 'GET', 'http://test/x')
+        self.assertEqual(2, self.mock_session.request.call_count)
+
+        self.assertRaisesRegex(common.QSANApiException,
+                               'consecutive failures',
+                               self.client._request, 'GET', 'http://test/x')
+
+        self.assertEqual(common._CircuitBreaker.OPEN,
+                         self.client._breaker.state)
+        self.assertEqual(2, self.mock_session.request.call_count)
+
+    @mock.patch('cinder.volume.drivers.qsan.common.time.monotonic')
+    def test_request_breaker_half_open_probe(self, mock_monotonic):
+        """Test a successful probe after the reset timeout closes it."""
+        mock_monotonic.return_value = 100
+        self.client._breaker.record_failure()
+        self.client._breaker.record_failure()
+        self.mock_session.request.return_value = self.resp_ok
+
+        mock_monotonic.return_value = 129
+        self.assertRaises(common.QSANApiException,
+                          self.client._request, 'GET', 'http://test/x')
+        self.mock_session.request.assert_not_called()
+
+        mock_monotonic.return_value = 130
+        self.client._request('GET', 'http://test/x')
+
+        self.assertEqual(1, self.mock_session.request.call_count)
+        self.assertEqual(common._CircuitBreaker.CLOSED,
+                         self.client._breaker.state)
+
+    @mock.patch('cinder.volume.drivers.qsan.common.time.monotonic')
+    def test_breaker_half_open_probe_expires(self, mock_monotonic):
+        """Test a probe that never reports back does not block forever."""
+        breaker = common._CircuitBreaker(2, 30)
+        mock_monotonic.return_value = 100
+        breaker.record_failure()
+        breaker.record_failure()
+
+        mock_monotonic.return_value = 130
+        breaker.before()
+        self.assertEqual(common._CircuitBreaker.HALF_OPEN, breaker.state)
+
+        mock_monotonic.return_value = 159
+        self.assertRaises(common.QSANApiException, breaker.before)
+
+        mock_monotonic.return_value = 160
+        breaker.before()
+        self.assertEqual(common._CircuitBreaker.HALF_OPEN, breaker.state)
+
+    @mock.patch('cinder.volume.drivers.qsan.common.time.monotonic')
+    def test_request_breaker_probe_relogin_fails(self, mock_monotonic):
+        """Test a probe whose re-login fails re-opens the breaker."""
+        mock_monotonic.return_value = 100
+        self.client._breaker.record_failure()
+        self.client._breaker.record_failure()
+        self.mock_session.request.return_value = _mock_response(401)
+
+        mock_monotonic.return_value = 130
+        with mock.patch.object(self.client, 'login') as mock_login:
+            mock_login.side_effect = common.QSANApiException(
+                message='Login failed')
+            self.assertRaisesRegex(common.QSANApiException, 'Login failed',
+                                   self.client._request, 'GET',
+                                   'http://test/x')
+
+        self.assertEqual(common._CircuitBreaker.OPEN,
+                         self.client._breaker.state)
+        self.mock_session.request.return_value = self.resp_ok
+        mock_monotonic.return_value = 160
+        self.client._request('GET', 'http://test/x')
+
+        self.assertEqual(2, self.mock_session.request.call_count)
+        self.assertEqual(common._CircuitBreaker.CLOSED,
+                         self.client._breaker.state)
+
+    @ddt.data('GET', 'PUT', 'PATCH', 'DELETE')
+    def test_request_relogin_on_expired_token(self, method):
+        """Test an idempotent request is re-sent after logging in again."""
+        self.mock_session.request.side_effect = iter(
+            [_mock_response(401), self.resp_volume])
+
+        with mock.patch.object(self.client, 'login') as mock_login:
+            result = self.client._request(method, 'http://test/x')
+
+        mock_login.assert_called_once_with()
+        self.assertEqual(FAKE_VOLUME_NAME, result['name'])
+        self.assertEqual(2, self.mock_session.request.call_count)
 
-        # First two calls fail, third succeeds
-        mock_session.request.side_effect = [
-            requests.exceptions.ConnectionError('Connection failed'),
-            requests.exceptions.ConnectionError('Connection failed'),
-            self._mock_response(200, {'result': 'success'}),
-        ]
+    def test_extend_volume_relogin_on_expired_token(self):
+        """Test an extend survives an expired token."""
+        self.mock_session.request.side_effect = iter(
+            [_mock_response(401), self.resp_ok])
 
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        with mock.patch.object(self.client, 'login') as mock_login:
+            self.client.extend_volume(FAKE_VOLUME_NAME, 20)
 
-        result = self.client._request('GET', 'http://test/api/test')
+        mock_login.assert_called_once_with()
+        self.assertEqual(2, self.mock_session.request.call_count)
+        self._assert_request('volume_extend')
 
-        self.assertEqual(3, mock_session.request.call_count)
-        self.assertEqual('success', result['result'])
+    def test_request_no_relogin_for_post(self):
+        """Test a POST is not re-sent after an expired token."""
+        self.mock_session.request.return_value = _mock_response(401)
 
-    @mock.patch('requests.Session')
-    def test_request_max_retries_exceeded(self, mock_session_class):
-        """Test request fails after max retries."""
-        mock_session = mock.Mock()
-        mock_session_class.return_value = mock_session
-        mock_session.request.side_effect = requests.exceptions.ConnectionError(
-            'Connection failed')
+        with mock.patch.object(self.client, 'login') as mock_login:
+            self.assertRaises(common.QSANApiException,
+                              self.client._request, 'POST', 'http://test/x')
 
-        self.client.session = mock_session
-        self.client.session_token = FAKE_TOKEN
+        mock_login.assert_not_called()
+        self.assertEqual(1, self.mock_session.request.call_count)
 
-        self.assertRaises(
-            common.QSANApiException,
-            self.client._request,
-            'GET',
-            'http://test/api/test'
+    def test_request_relogin_only_once(self):
+        """Test a token still rejected after logging in again fails."""
+        self.mock_session.request.return_value = _mock_response(401)
+
+        with mock.patch.object(self.client, 'login') as mock_login:
+            self.assertRaises(common.QSANApiException,
+                              self.client._request, 'GET', 'http://test/x')
+
+        mock_login.assert_called_once_with()
+        self.assertEqual(2, self.mock_session.request.call_count)
+
+    def test_request_breaker_ignores_client_errors(self):
+        """Test 4xx responses do not count as controller failures."""
+        self.mock_session.request.return_value = _mock_response(404)
+
+        for _ in range(3):
+            self.assertRaises(common.QSANApiException,
+                              self.client._request, 'GET', 'http://test/x')
+
+        self.assertEqual(3, self.mock_session.request.call_count)
+        self.assertEqual(common._CircuitBreaker.CLOSED,
+                         self.client._breaker.state)
+
+
+@ddt.ddt
+class QSANClientTransportTestCase(test.TestCase):
+    """Test QSANClient request building against a mocked transport.
+
+    Unlike QSANClientTestCase, the client keeps a real requests.Session
+    here, so headers, query parameters and JSON bodies go through the
+    same code path as in production and only the HTTP adapter is faked.
+    """
+
+    def setUp(self):
+        super(QSANClientTransportTestCase, self).setUp()
+        self.requests_mock = self.useFixture(
+            requests_mock_fixture.Fixture())
+        self.client = common.QSANClient(
+            host=FAKE_HOST,
+            port=FAKE_PORT,
+            protocol=FAKE_PROTOCOL,
+            username=FAKE_USERNAME,
+            password=FAKE_PASSWORD,
+            ssl_verify=False,
+            timeout=60,
+            retry_count=3,
         )
+        self.base_url = f'{FAKE_PROTOCOL}://{FAKE_HOST}:{FAKE_PORT}'
+        for (method, path), body in _REPLAY_RESPONSES.items():
+            self.requests_mock.register_uri(method, self.base_url + path,
+                                            json=body)
+
+    def _login(self):
+        self.client.login()
+
+    def test_login(self):
+        """Test login posts the credentials and stores the token."""
+        self._login()
+
+        self.assertEqual(FAKE_TOKEN, self.client.session_token)
+        self.assertEqual({'user': FAKE_USERNAME,
+                          'password': FAKE_PASSWORD,
+                          'scopes': 'all'},
+                         self.requests_mock.last_request.json())
+
+    def test_logout(self):
+        """Test logout revokes the token and drops it from the session."""
+        self._login()
+        session = self.client.session
+
+        self.client.logout()
+
+        self.assertIsNone(self.client.session_token)
+        self.assertNotIn('Authorization', session.headers)
+        self.assertEqual({'refreshToken': FAKE_TOKEN},
+                         self.requests_mock.last_request.json())
+
+    def test_login_after_logout_reuses_session(self):
+        """Test a new login keeps the session and its connection pool."""
+        self._login()
+        session = self.client.session
+        self.client.logout()
 
-        self.assertEqual(3, mock_session.request.call_count)
+        self._login()
+
+        self.assertIs(session, self.client.session)
+        self.assertEqual('Bearer ' + FAKE_TOKEN,
+                         session.headers['Authorization'])
+
+    @ddt.data(
+        ('get_volume', (FAKE_VOLUME_NAME,),
+         {'id': 'vol-001', 'name': FAKE_VOLUME_NAME}),
+        ('get_pool_stats', (FAKE_POOL_NAME,),
+         {'total_capacity': 1099511627776,
+          'free_capacity': 549755813888,
+          'used_capacity': 549755813888}),
+        ('get_system_version', (), '5.0.0'),
+        ('get_iscsi_portals', (), ['192.168.1.101']),
+        ('create_iscsi_target', (FAKE_TARGET_NAME,),
+         {'id': FAKE_TARGET_ID, 'iqn': FAKE_TARGET_IQN}),
+        ('map_volume_to_target', (FAKE_VOLUME_NAME, FAKE_TARGET_ID),
+         {'lun_id': FAKE_LUN_ID}),
+    )
+    @ddt.unpack
+    def test_replayed_request(self, method, args, expected):
+        """Test happy-path calls parse the replayed controller replies."""
+        self._login()
+
+        self.assertEqual(expected, getattr(self.client, method)(*args))
+
+    def test_create_volume(self):
+        """Test create volume sends the token and a JSON body in MB."""
+        self._login()
+        self.requests_mock.post(
+            self.base_url + '/rest/v2/storage/block/volumes',
+            json={'id': 'vol-001', 'name': FAKE_VOLUME_NAME})
+
+        result = self.client.create_volume(FAKE_POOL_NAME, FAKE_VOLUME_NAME,
+                                           10)
+
+        self.assertEqual('vol-001', result['id'])
+        last_request = self.requests_mock.last_request
+        self.assertEqual('Bearer ' + FAKE_TOKEN,
+                         last_request.headers['Authorization'])
+        self.assertEqual({'poolId': FAKE_POOL_NAME,
+                          'name': FAKE_VOLUME_NAME,
+                          'totalSize': 10240,
+                          'type': 'THIN'},
+                         last_request.json())
+
+    def test_cached_reads_keep_token_in_header(self):
+        """Test reads served from the cache never put the token in a URL."""
+        self._login()
+
+        self.client.get_iscsi_portals()
+        self.client.get_system_version()
+        self.client.get_pool_stats(FAKE_POOL_NAME)
+        self.client.get_pool_stats(FAKE_POOL_NAME)
+
+        reads = [r for r in self.requests_mock.request_history
+                 if r.method == 'GET']
+        self.assertEqual(3, len(reads))
+        for request in reads:
+            self.assertEqual({}, request.qs)
+            self.assertEqual('Bearer ' + FAKE_TOKEN,
+                             request.headers['Authorization'])
+
+    def test_delete_volume_empty_response(self):
+        """Test an empty response body is returned as None."""
+        self._login()
+        self.requests_mock.delete(
+            self.base_url + '/rest/v2/storage/block/volumes/' +
+            FAKE_VOLUME_NAME)
+
+        self.assertIsNone(self.client.delete_volume(FAKE_VOLUME_NAME))
+        self.assertEqual('DELETE', self.requests_mock.last_request.method)
+
+    def test_request_connection_error(self):
+        """Test a transport error is raised as QSANApiException."""
+        self._login()
+        url = self.base_url + '/rest/v2/system/info'
+        self.requests_mock.get(url, exc=ReqConnError)
+
+        self.assertRaises(common.QSANApiException,
+                          self.client.get_system_info_v2)
+        self.assertEqual(2, self.requests_mock.call_count)
+
+    def test_request_http_error(self):
+        """Test an HTTP error status is raised as QSANApiException."""
+        self._login()
+        url = self.base_url + '/rest/v2/storage/pools/' + FAKE_POOL_NAME
+        self.requests_mock.get(url, status_code=400)
+
+        self.assertRaises(common.QSANApiException,
+                          self.client.get_pool, FAKE_POOL_NAME)
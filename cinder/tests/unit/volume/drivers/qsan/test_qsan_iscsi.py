@@ -15,15 +15,21 @@
 
 """Unit tests for QSAN iSCSI volume driver."""
 
+import types
+import unittest
 from unittest import mock
 
+import ddt
+import eventlet
+
 from cinder import context
 from cinder import exception
+from cinder.tests import fixtures as cinder_fixtures
 from cinder.tests.unit import fake_constants as fake
 from cinder.tests.unit import fake_volume
-from cinder.tests.unit import test
 from cinder.volume import configuration as conf
 from cinder.volume.drivers.qsan import common
+from cinder.volume.drivers.qsan import options
 from cinder.volume.drivers.qsan import qsan_iscsi
 
 
@@ -38,131 +44,165 @@ FAKE_TARGET_IQN = 'iqn.2004-08.com.qsan:target-' + fake.VOLUME_ID
 FAKE_TARGET_ID = 'target-001'
 FAKE_LUN_ID = 0
 FAKE_INITIATOR_IQN = 'iqn.1993-08.org.debian:01:604af6a341'
+FAKE_PROVIDER_LOCATION = (
+    f'{FAKE_ISCSI_PORTAL_1}:3260;{FAKE_ISCSI_PORTAL_2}:3260 '
+    f'{FAKE_TARGET_IQN} {FAKE_LUN_ID}'
+)
 
-FAKE_VOLUME = {
+FAKE_VOLUME = types.MappingProxyType({
     'name': fake.VOLUME_NAME,
     'id': fake.VOLUME_ID,
     'display_name': 'fake_volume',
     'size': 10,
     'provider_location': None,
-}
+})
 
-FAKE_VOLUME_WITH_LOCATION = {
+FAKE_VOLUME_WITH_LOCATION = types.MappingProxyType({
     'name': fake.VOLUME_NAME,
     'id': fake.VOLUME_ID,
     'display_name': 'fake_volume',
     'size': 10,
-    'provider_location': (
-        f'{FAKE_ISCSI_PORTAL_1}:3260;{FAKE_ISCSI_PORTAL_2}:3260 '
-        f'{FAKE_TARGET_IQN} {FAKE_LUN_ID}'
-    ),
+    'provider_location': FAKE_PROVIDER_LOCATION,
     'provider_auth': None,
-}
+})
 
-FAKE_NEW_VOLUME = {
+FAKE_NEW_VOLUME = types.MappingProxyType({
     'name': fake.VOLUME2_NAME,
     'id': fake.VOLUME2_ID,
     'display_name': 'new_fake_volume',
     'size': 10,
-}
+})
 
-FAKE_SNAPSHOT = {
+FAKE_SNAPSHOT = types.MappingProxyType({
     'name': fake.SNAPSHOT_NAME,
     'id': fake.SNAPSHOT_ID,
     'volume_id': fake.VOLUME_ID,
     'volume_name': fake.VOLUME_NAME,
     'volume_size': 10,
     'display_name': 'fake_snapshot',
-}
+})
 
-FAKE_CONNECTOR = {
+FAKE_CONNECTOR = types.MappingProxyType({
     'initiator': FAKE_INITIATOR_IQN,
     'host': 'fakehost',
+})
+
+# None of the tests modify the admin context, so one instance is shared.
+_ADMIN_CTX = context.get_admin_context()
+
+# Autospeccing introspects QSANClient, so a single prototype is created
+# here and reset in setUp. spec_set also rejects assignments to attributes
+# the real client does not have.
+_CLIENT_PROTO = mock.create_autospec(common.QSANClient, spec_set=True,
+                                     instance=True)
+
+# The Configuration attribute list and option values are computed once per
+# module; each test still gets its own Mock, so tests that change an option
+# do not affect each other.
+_CONFIG_SPEC = dir(conf.Configuration)
+_CONFIG_VALUES = {
+    'qsan_management_ip': FAKE_MANAGEMENT_IP,
+    'qsan_management_port': 443,
+    'qsan_management_protocol': 'https',
+    'qsan_login': FAKE_USERNAME,
+    'qsan_password': FAKE_PASSWORD,
+    'qsan_pool_name': FAKE_POOL_NAME,
+    'qsan_ssl_verify': False,
+    'qsan_api_timeout': 60,
+    'qsan_connect_timeout': 5,
+    'qsan_retry_count': 3,
+    'qsan_retry_backoff_cap': 30,
+    'qsan_retry_jitter': 0.5,
+    'qsan_breaker_threshold': 5,
+    'qsan_breaker_reset': 30,
+    'qsan_compress_requests': False,
+    'qsan_pool_maxsize': 32,
+    'qsan_io_pool_workers': 8,
+    'qsan_stats_refresh_interval': 0,
+    'qsan_export_on_create': False,
+    'qsan_iscsi_portals': [FAKE_ISCSI_PORTAL_1, FAKE_ISCSI_PORTAL_2],
+    'qsan_chap_enabled': False,
+    'qsan_chap_username': None,
+    'qsan_chap_password': None,
+    'qsan_thin_provision': True,
+    'reserved_percentage': 0,
+    'max_over_subscription_ratio': 1.0,
 }
 
 
-class QSANISCSIDriverTestCase(test.TestCase):
+@ddt.ddt
+class QSANISCSIDriverTestCase(unittest.TestCase):
     """Test cases for QSANISCSIDriver."""
 
     def setUp(self):
         super(QSANISCSIDriverTestCase, self).setUp()
+        # test.TestCase is not used, so capture the driver's log output
+        # the same way it would.
+        logging_fixture = cinder_fixtures.StandardLogging()
+        logging_fixture.setUp()
+        self.addCleanup(logging_fixture.cleanUp)
+
+        # Mock the QSAN client; the prototype is reset rather than rebuilt
+        _CLIENT_PROTO.reset_mock(return_value=True, side_effect=True)
+        self.mock_client = _CLIENT_PROTO
+
+        self._create_driver()
+        self.context = _ADMIN_CTX
+
+    def _create_configuration(self, **overrides):
+        """Create a mock configuration, optionally overriding options."""
+        config = mock.Mock(spec=_CONFIG_SPEC,
+                           **dict(_CONFIG_VALUES, **overrides))
+        # Only the backend name is set; anything else, such as the trace
+        # flags read by the base driver, is left unset.
+        config.safe_get = mock.Mock(
+            side_effect={'volume_backend_name': 'QSAN_iSCSI'}.get)
+        return config
 
-        self.configuration = self._create_configuration()
+    def _create_driver(self, **config_overrides):
+        """(Re)create the driver under test with the given options."""
+        self.configuration = self._create_configuration(**config_overrides)
         self.driver = qsan_iscsi.QSANISCSIDriver(
             configuration=self.configuration)
-
-        # Mock the QSAN client
-        self.mock_client = mock.Mock(spec=common.QSANClient)
         self.driver._qsan_client = self.mock_client
 
-        self.context = context.get_admin_context()
-
-    def _create_configuration(self):
-        """Create a mock configuration."""
-        config = mock.Mock(spec=conf.Configuration)
-        config.qsan_management_ip = FAKE_MANAGEMENT_IP
-        config.qsan_management_port = 443
-        config.qsan_management_protocol = 'https'
-        config.qsan_login = FAKE_USERNAME
-        config.qsan_password = FAKE_PASSWORD
-        config.qsan_pool_name = FAKE_POOL_NAME
-        config.qsan_ssl_verify = False
-        config.qsan_api_timeout = 60
-        config.qsan_retry_count = 3
-        config.qsan_iscsi_portals = [FAKE_ISCSI_PORTAL_1, FAKE_ISCSI_PORTAL_2]
-        config.qsan_chap_enabled = False
-        config.qsan_chap_username = None
-        config.qsan_chap_password = None
-        config.qsan_thin_provision = True
-        config.reserved_percentage = 0
-        config.max_over_subscription_ratio = 1.0
-        config.safe_get = mock.Mock(return_value='QSAN_iSCSI')
-        return config
-
     def _create_volume(self, volume_id=fake.VOLUME_ID, size=10,
                        provider_location=None, provider_auth=None):
         """Create a fake volume object."""
-        volume = fake_volume.fake_volume_obj(self.context)
-        volume.id = volume_id
-        volume.size = size
-        volume.provider_location = provider_location
-        volume.provider_auth = provider_auth
-        return volume
+        return fake_volume.fake_volume_obj(
+            self.context, id=volume_id, size=size,
+            provider_location=provider_location,
+            provider_auth=provider_auth)
 
     def _create_snapshot(self, snapshot_id=fake.SNAPSHOT_ID, volume=None):
         """Create a fake snapshot object."""
         if volume is None:
             volume = self._create_volume()
 
-        snapshot = mock.Mock()
-        snapshot.id = snapshot_id
-        snapshot.volume = volume
-        snapshot.volume_id = volume.id
-        return snapshot
+        return types.SimpleNamespace(id=snapshot_id, volume=volume,
+                                     volume_id=volume.id)
 
     # ========== Setup Tests ==========
 
-    def test_do_setup(self):
+    @mock.patch.object(common, 'QSANClient')
+    def test_do_setup(self, mock_client_class):
         """Test driver do_setup."""
-        with mock.patch.object(common, 'QSANClient') as mock_client_class:
-            mock_client_instance = mock.Mock()
-            mock_client_class.return_value = mock_client_instance
+        mock_client_instance = mock_client_class.return_value
 
-            self.driver.do_setup(self.context)
+        self.driver.do_setup(mock.sentinel.context)
 
-            mock_client_class.assert_called_once()
-            mock_client_instance.login.assert_called_once()
+        mock_client_class.assert_called_once()
+        mock_client_instance.login.assert_called_once()
 
-    def test_do_setup_login_failure(self):
+    @mock.patch.object(common, 'QSANClient')
+    def test_do_setup_login_failure(self, mock_client_class):
         """Test driver do_setup when login fails."""
-        with mock.patch.object(common, 'QSANClient') as mock_client_class:
-            mock_client_instance = mock.Mock()
-            mock_client_class.return_value = mock_client_instance
-            mock_client_instance.login.side_effect = (
-                common.QSANApiException(message='Login failed'))
+        mock_client_class.return_value.login.side_effect = (
+            common.QSANApiException(message='Login failed'))
 
-            self.assertRaises(exception.VolumeDriverException,
-                              self.driver.do_setup, self.context)
+        self.assertRaisesRegex(exception.VolumeDriverException,
+                               'Login failed',
+                               self.driver.do_setup, mock.sentinel.context)
 
     def test_check_for_setup_error(self):
         """Test check_for_setup_error with valid config."""
@@ -171,22 +211,28 @@ class QSANISCSIDriverTestCase(test.TestCase):
         # Should not raise any exception
         self.driver.check_for_setup_error()
 
-        self.mock_client.get_pool.assert_called_once_with(FAKE_POOL_NAME)
+        self.assertEqual([mock.call.get_pool(FAKE_POOL_NAME)],
+                         self.mock_client.mock_calls)
 
     def test_check_for_setup_error_pool_not_found(self):
         """Test check_for_setup_error when pool not found."""
         self.mock_client.get_pool.side_effect = (
             common.QSANApiException(message='Pool not found'))
 
-        self.assertRaises(exception.VolumeDriverException,
-                          self.driver.check_for_setup_error)
+        self.assertRaisesRegex(exception.VolumeDriverException,
+                               f"QSAN pool '{FAKE_POOL_NAME}' not found",
+                               self.driver.check_for_setup_error)
 
-    def test_check_for_setup_error_missing_config(self):
-        """Test check_for_setup_error with missing config."""
-        self.configuration.qsan_management_ip = None
+    @ddt.data('qsan_management_ip', 'qsan_login', 'qsan_password',
+              'qsan_pool_name')
+    def test_check_for_setup_error_missing_config(self, opt):
+        """Test check_for_setup_error with a required option unset."""
+        self._create_driver(**{opt: None})
 
-        self.assertRaises(exception.VolumeDriverException,
-                          self.driver.check_for_setup_error)
+        self.assertRaisesRegex(exception.VolumeDriverException,
+                               f"'{opt}' is not set",
+                               self.driver.check_for_setup_error)
+        self.mock_client.get_pool.assert_not_called()
 
     # ========== Volume Stats Tests ==========
 
@@ -214,6 +260,32 @@ class QSANISCSIDriverTestCase(test.TestCase):
         self.assertTrue(result['cached'])
         self.mock_client.get_pool_stats.assert_not_called()
 
+    def test_get_volume_stats_background(self):
+        """Test a refresh is left to the background loop when it runs."""
+        self.driver._stats = {'cached': True}
+        self.driver._stats_loop = mock.Mock()
+
+        result = self.driver.get_volume_stats(refresh=True)
+
+        self.assertTrue(result['cached'])
+        self.mock_client.get_pool_stats.assert_not_called()
+
+    @mock.patch.object(qsan_iscsi.loopingcall, 'FixedIntervalLoopingCall')
+    @mock.patch.object(common, 'QSANClient')
+    def test_do_setup_stats_refresh(self, mock_client_class, mock_loop):
+        """Test the stats loop is started by setup and stopped on exit."""
+        self._create_driver(qsan_stats_refresh_interval=60)
+
+        self.driver.do_setup(mock.sentinel.context)
+
+        mock_loop.assert_called_once_with(self.driver._update_volume_stats)
+        mock_loop.return_value.start.assert_called_once_with(interval=60)
+
+        self.driver.terminate()
+
+        mock_loop.return_value.stop.assert_called_once_with()
+        self.assertIsNone(self.driver._stats_loop)
+
     # ========== Volume Operations Tests ==========
 
     def test_create_volume(self):
@@ -224,12 +296,83 @@ class QSANISCSIDriverTestCase(test.TestCase):
         result = self.driver.create_volume(volume)
 
         self.assertIsNone(result)
-        self.mock_client.create_volume.assert_called_once_with(
-            FAKE_POOL_NAME,
-            f'volume-{volume.id}',
-            volume.size,
-            thin=True
-        )
+        self.assertEqual(
+            [mock.call.create_volume(FAKE_POOL_NAME, f'volume-{volume.id}',
+                                     volume.size, thin=True)],
+            self.mock_client.mock_calls)
+
+    def test_create_volume_export_on_create(self):
+        """Test the export is created together with the volume."""
+        self._create_driver(qsan_export_on_create=True)
+        volume = self._create_volume()
+        self.mock_client.configure_mock(**{
+            'create_iscsi_target.return_value': {
+                'id': FAKE_TARGET_ID,
+                'iqn': FAKE_TARGET_IQN,
+            },
+            'map_volume_to_target.return_value': {'lun_id': FAKE_LUN_ID},
+        })
+
+        result = self.driver.create_volume(volume)
+
+        self.assertIn(FAKE_TARGET_IQN, result['provider_location'])
+        self.mock_client.resolve_target_id.assert_not_called()
+        self.mock_client.map_volume_to_target.assert_called_once_with(
+            f'volume-{volume.id}', FAKE_TARGET_ID)
+
+    def test_create_volume_export_on_create_failure(self):
+        """Test a failed pre-export leaves the export to attach time."""
+        self._create_driver(qsan_export_on_create=True)
+        volume = self._create_volume()
+        self.mock_client.create_iscsi_target.side_effect = (
+            common.QSANApiException(message='Target failed'))
+
+        with self.assertLogs(qsan_iscsi.LOG.logger, 'WARNING'):
+            self.assertIsNone(self.driver.create_volume(volume))
+
+    @ddt.data(FAKE_TARGET_ID, None)
+    def test_delete_volume_export_on_create(self, target_id):
+        """Test a target made with the volume is deleted before it."""
+        self._create_driver(qsan_export_on_create=True)
+        volume = self._create_volume()
+        self.mock_client.resolve_target_id.return_value = target_id
+        self.mock_client.delete_volume_if_exists.return_value = True
+
+        self.driver.delete_volume(volume)
+
+        expected = [mock.call.resolve_target_id(f'target-{volume.id}')]
+        if target_id:
+            expected.append(
+                mock.call.delete_iscsi_target_if_exists(FAKE_TARGET_ID))
+        expected.append(
+            mock.call.delete_volume_if_exists(f'volume-{volume.id}'))
+        self.assertEqual(expected, self.mock_client.mock_calls)
+
+    @ddt.data((FAKE_TARGET_ID, False), (None, True))
+    @ddt.unpack
+    def test_create_export_after_export_on_create(self, target_id,
+                                                  expect_create):
+        """Test attach reuses a target created with the volume."""
+        self._create_driver(qsan_export_on_create=True)
+        volume = self._create_volume(
+            provider_location=FAKE_PROVIDER_LOCATION)
+        self.mock_client.configure_mock(**{
+            'resolve_target_id.return_value': target_id,
+            'create_iscsi_target.return_value': {
+                'id': FAKE_TARGET_ID,
+                'iqn': FAKE_TARGET_IQN,
+            },
+            'map_volume_to_target.return_value': {'lun_id': FAKE_LUN_ID},
+        })
+
+        result = self.driver.create_export(mock.sentinel.context, volume,
+                                           FAKE_CONNECTOR)
+
+        self.mock_client.resolve_target_id.assert_called_once_with(
+            f'target-{volume.id}')
+        self.assertEqual(expect_create,
+                         self.mock_client.create_iscsi_target.called)
+        self.assertEqual(expect_create, result is not None)
 
     def test_create_volume_failure(self):
         """Test create_volume when API fails."""
@@ -237,28 +380,32 @@ class QSANISCSIDriverTestCase(test.TestCase):
         self.mock_client.create_volume.side_effect = (
             common.QSANApiException(message='Create failed'))
 
-        self.assertRaises(exception.VolumeBackendAPIException,
-                          self.driver.create_volume, volume)
+        self.assertRaisesRegex(exception.VolumeBackendAPIException,
+                               'Create failed',
+                               self.driver.create_volume, volume)
 
-    def test_delete_volume(self):
-        """Test delete_volume."""
+    @ddt.data(True, False)
+    def test_delete_volume(self, existed):
+        """Test delete_volume with and without the backend volume."""
         volume = self._create_volume()
-        self.mock_client.get_volume.return_value = {'id': 'vol-001'}
+        self.mock_client.delete_volume_if_exists.return_value = existed
 
         self.driver.delete_volume(volume)
 
-        self.mock_client.delete_volume.assert_called_once_with(
-            f'volume-{volume.id}')
+        self.assertEqual(
+            [mock.call.delete_volume_if_exists(f'volume-{volume.id}')],
+            self.mock_client.mock_calls)
 
-    def test_delete_volume_not_found(self):
-        """Test delete_volume when volume not found."""
+    def test_delete_volume_error(self):
+        """Test a failed delete is raised as a backend error."""
         volume = self._create_volume()
-        self.mock_client.get_volume.return_value = None
+        self.mock_client.delete_volume_if_exists.side_effect = (
+            common.QSANApiException(message='Volume busy'))
 
-        # Should not raise exception
-        self.driver.delete_volume(volume)
-
-        self.mock_client.delete_volume.assert_not_called()
+        with self.assertLogs(qsan_iscsi.LOG.logger, 'ERROR'):
+            self.assertRaisesRegex(exception.VolumeBackendAPIException,
+                                   'Volume busy',
+                                   self.driver.delete_volume, volume)
 
     def test_extend_volume(self):
         """Test extend_volume."""
@@ -267,8 +414,9 @@ class QSANISCSIDriverTestCase(test.TestCase):
 
         self.driver.extend_volume(volume, new_size)
 
-        self.mock_client.extend_volume.assert_called_once_with(
-            f'volume-{volume.id}', new_size)
+        self.assertEqual(
+            [mock.call.extend_volume(f'volume-{volume.id}', new_size)],
+            self.mock_client.mock_calls)
 
     def test_extend_volume_failure(self):
         """Test extend_volume when API fails."""
@@ -276,8 +424,9 @@ class QSANISCSIDriverTestCase(test.TestCase):
         self.mock_client.extend_volume.side_effect = (
             common.QSANApiException(message='Extend failed'))
 
-        self.assertRaises(exception.VolumeBackendAPIException,
-                          self.driver.extend_volume, volume, 20)
+        self.assertRaisesRegex(exception.VolumeBackendAPIException,
+                               'Extend failed',
+                               self.driver.extend_volume, volume, 20)
 
     # ========== iSCSI Export Tests ==========
 
@@ -285,15 +434,16 @@ class QSANISCSIDriverTestCase(test.TestCase):
         """Test create_export."""
         volume = self._create_volume()
 
-        self.mock_client.create_iscsi_target.return_value = {
-            'id': FAKE_TARGET_ID,
-            'iqn': FAKE_TARGET_IQN,
-        }
-        self.mock_client.map_volume_to_target.return_value = {
-            'lun_id': FAKE_LUN_ID,
-        }
+        self.mock_client.configure_mock(**{
+            'create_iscsi_target.return_value': {
+                'id': FAKE_TARGET_ID,
+                'iqn': FAKE_TARGET_IQN,
+            },
+            'map_volume_to_target.return_value': {'lun_id': FAKE_LUN_ID},
+        })
 
-        result = self.driver.create_export(self.context, volume, FAKE_CONNECTOR)
+        result = self.driver.create_export(mock.sentinel.context, volume,
+                                           FAKE_CONNECTOR)
 
         self.assertIn('provider_location', result)
         self.assertIn(FAKE_TARGET_IQN, result['provider_location'])
@@ -304,60 +454,91 @@ class QSANISCSIDriverTestCase(test.TestCase):
         """Test create_export with CHAP authentication."""
         volume = self._create_volume()
 
-        self.configuration.qsan_chap_enabled = True
-        self.configuration.qsan_chap_username = 'chap_user'
-        self.configuration.qsan_chap_password = 'chap_pass'
+        self._create_driver(qsan_chap_enabled=True,
+                            qsan_chap_username='chap_user',
+                            qsan_chap_password='chap_pass')
 
-        self.mock_client.create_iscsi_target.return_value = {
-            'id': FAKE_TARGET_ID,
-            'iqn': FAKE_TARGET_IQN,
-        }
-        self.mock_client.map_volume_to_target.return_value = {
-            'lun_id': FAKE_LUN_ID,
-        }
+        self.mock_client.configure_mock(**{
+            'create_iscsi_target.return_value': {
+                'id': FAKE_TARGET_ID,
+                'iqn': FAKE_TARGET_IQN,
+            },
+            'map_volume_to_target.return_value': {'lun_id': FAKE_LUN_ID},
+        })
 
-        result = self.driver.create_export(self.context, volume, FAKE_CONNECTOR)
+        result = self.driver.create_export(mock.sentinel.context, volume,
+                                           FAKE_CONNECTOR)
 
         self.assertIn('provider_auth', result)
         self.assertEqual('CHAP chap_user chap_pass', result['provider_auth'])
         self.mock_client.set_target_chap.assert_called_once()
 
-    def test_remove_export(self):
-        """Test remove_export."""
+    def test_create_export_chap_error(self):
+        """Test a CHAP failure fails the export once mapping is done."""
         volume = self._create_volume()
+        self._create_driver(qsan_chap_enabled=True,
+                            qsan_chap_username='chap_user',
+                            qsan_chap_password='chap_pass')
+        self.mock_client.configure_mock(**{
+            'create_iscsi_target.return_value': {
+                'id': FAKE_TARGET_ID,
+                'iqn': FAKE_TARGET_IQN,
+            },
+            'map_volume_to_target.return_value': {'lun_id': FAKE_LUN_ID},
+            'set_target_chap.side_effect': common.QSANApiException(
+                message='CHAP rejected'),
+        })
+
+        with self.assertLogs(qsan_iscsi.LOG.logger, 'ERROR'):
+            self.assertRaisesRegex(exception.VolumeBackendAPIException,
+                                   'CHAP rejected',
+                                   self.driver.create_export,
+                                   mock.sentinel.context, volume,
+                                   FAKE_CONNECTOR)
+
+        self.mock_client.map_volume_to_target.assert_called_once_with(
+            f'volume-{volume.id}', FAKE_TARGET_ID)
+
+    @ddt.data((FAKE_TARGET_ID, True), (None, False))
+    @ddt.unpack
+    def test_remove_export(self, get_return, expect_delete):
+        """Test remove_export with and without the backend target."""
+        volume = self._create_volume()
+        self.mock_client.resolve_target_id.return_value = get_return
+        self.mock_client.delete_iscsi_target_if_exists.return_value = True
 
-        self.mock_client.get_iscsi_target_by_name.return_value = {
-            'id': FAKE_TARGET_ID,
-        }
-
-        self.driver.remove_export(self.context, volume)
+        self.driver.remove_export(mock.sentinel.context, volume)
 
-        self.mock_client.delete_iscsi_target.assert_called_once_with(
-            FAKE_TARGET_ID)
+        expected = [mock.call.resolve_target_id(f'target-{volume.id}')]
+        if expect_delete:
+            expected.append(
+                mock.call.delete_iscsi_target_if_exists(FAKE_TARGET_ID))
+        self.assertEqual(expected, self.mock_client.mock_calls)
 
-    def test_remove_export_target_not_found(self):
-        """Test remove_export when target not found."""
+    def test_remove_export_stale_target_id(self):
+        """Test a stale cached target id is resolved again once."""
         volume = self._create_volume()
+        self.mock_client.resolve_target_id.side_effect = ['stale-id',
+                                                          FAKE_TARGET_ID]
+        self.mock_client.delete_iscsi_target_if_exists.side_effect = [
+            False, True]
 
-        self.mock_client.get_iscsi_target_by_name.return_value = None
-
-        # Should not raise exception
-        self.driver.remove_export(self.context, volume)
+        self.driver.remove_export(mock.sentinel.context, volume)
 
-        self.mock_client.delete_iscsi_target.assert_not_called()
+        target_name = f'target-{volume.id}'
+        self.assertEqual(
+            [mock.call.resolve_target_id(target_name),
+             mock.call.delete_iscsi_target_if_exists('stale-id'),
+             mock.call.resolve_target_id(target_name, refresh=True),
+             mock.call.delete_iscsi_target_if_exists(FAKE_TARGET_ID)],
+            self.mock_client.mock_calls)
 
     def test_initialize_connection(self):
         """Test initialize_connection."""
         volume = self._create_volume(
-            provider_location=(
-                f'{FAKE_ISCSI_PORTAL_1}:3260;{FAKE_ISCSI_PORTAL_2}:3260 '
-                f'{FAKE_TARGET_IQN} {FAKE_LUN_ID}'
-            )
-        )
-
-        self.mock_client.get_iscsi_target_by_name.return_value = {
-            'id': FAKE_TARGET_ID,
-        }
+            provider_location=FAKE_PROVIDER_LOCATION)
+
+        self.mock_client.resolve_target_id.return_value = FAKE_TARGET_ID
 
         result = self.driver.initialize_connection(volume, FAKE_CONNECTOR)
 
@@ -365,38 +546,62 @@ class QSANISCSIDriverTestCase(test.TestCase):
         self.assertEqual(FAKE_TARGET_IQN, result['data']['target_iqn'])
         self.assertEqual(FAKE_LUN_ID, result['data']['target_lun'])
         self.mock_client.add_initiator_to_target.assert_called_once()
-
-    def test_initialize_connection_multipath(self):
-        """Test initialize_connection with multipath."""
-        volume = self._create_volume(
-            provider_location=(
-                f'{FAKE_ISCSI_PORTAL_1}:3260;{FAKE_ISCSI_PORTAL_2}:3260 '
-                f'{FAKE_TARGET_IQN} {FAKE_LUN_ID}'
-            )
-        )
-
-        self.mock_client.get_iscsi_target_by_name.return_value = {
-            'id': FAKE_TARGET_ID,
-        }
-
-        result = self.driver.initialize_connection(volume, FAKE_CONNECTOR)
-
-        # Check multipath properties
+        # Both configured portals are returned for multipath
         self.assertIn('target_portals', result['data'])
         self.assertEqual(2, len(result['data']['target_portals']))
 
+    @ddt.data(404, 500)
+    def test_initialize_connection_stale_target_id(self, code):
+        """Test only a 404 for the cached target id is retried."""
+        volume = self._create_volume(
+            provider_location=FAKE_PROVIDER_LOCATION)
+        self.mock_client.resolve_target_id.side_effect = ['stale-id',
+                                                          FAKE_TARGET_ID]
+        self.mock_client.add_initiator_to_target.side_effect = [
+            common.QSANApiException(message='Target failed', code=code),
+            None]
+
+        self.driver.initialize_connection(volume, FAKE_CONNECTOR)
+
+        expected = [mock.call('stale-id', initiator_iqn=FAKE_INITIATOR_IQN)]
+        if code == 404:
+            expected.append(
+                mock.call(FAKE_TARGET_ID, initiator_iqn=FAKE_INITIATOR_IQN))
+        self.assertEqual(
+            expected, self.mock_client.add_initiator_to_target.call_args_list)
+
+    def test_parse_provider_location_cached(self):
+        """Test a provider_location is parsed once and kept immutable."""
+        location = f'192.0.2.1:3260;192.0.2.2:3260 {FAKE_TARGET_IQN} 7'
+        qsan_iscsi._parse_provider_location.cache_clear()
+
+        first = qsan_iscsi._parse_provider_location(location)
+        second = qsan_iscsi._parse_provider_location(location)
+
+        self.assertIs(first, second)
+        self.assertEqual((('192.0.2.1:3260', '192.0.2.2:3260'),
+                          FAKE_TARGET_IQN, 7), first)
+        self.assertEqual(
+            1, qsan_iscsi._parse_provider_location.cache_info().hits)
+
     def test_terminate_connection(self):
         """Test terminate_connection."""
         volume = self._create_volume()
 
-        self.mock_client.get_iscsi_target_by_name.return_value = {
-            'id': FAKE_TARGET_ID,
-        }
+        self.mock_client.resolve_target_id.return_value = FAKE_TARGET_ID
 
         self.driver.terminate_connection(volume, FAKE_CONNECTOR)
 
         self.mock_client.remove_initiator_from_target.assert_called_once()
 
+    def test_terminate_connection_force_detach(self):
+        """Test a force detach leaves the target ACL untouched."""
+        volume = self._create_volume()
+
+        self.driver.terminate_connection(volume, None)
+
+        self.assertEqual([], self.mock_client.mock_calls)
+
     # ========== Snapshot Tests ==========
 
     def test_create_snapshot(self):
@@ -408,10 +613,10 @@ class QSANISCSIDriverTestCase(test.TestCase):
 
         self.driver.create_snapshot(snapshot)
 
-        self.mock_client.create_snapshot.assert_called_once_with(
-            f'volume-{volume.id}',
-            f'snapshot-{snapshot.id}'
-        )
+        self.assertEqual(
+            [mock.call.create_snapshot(f'volume-{volume.id}',
+                                       f'snapshot-{snapshot.id}')],
+            self.mock_client.mock_calls)
 
     def test_create_snapshot_failure(self):
         """Test create_snapshot when API fails."""
@@ -421,31 +626,23 @@ class QSANISCSIDriverTestCase(test.TestCase):
         self.mock_client.create_snapshot.side_effect = (
             common.QSANApiException(message='Snapshot failed'))
 
-        self.assertRaises(exception.VolumeBackendAPIException,
-                          self.driver.create_snapshot, snapshot)
+        self.assertRaisesRegex(exception.VolumeBackendAPIException,
+                               'Snapshot failed',
+                               self.driver.create_snapshot, snapshot)
 
-    def test_delete_snapshot(self):
-        """Test delete_snapshot."""
+    @ddt.data(True, False)
+    def test_delete_snapshot(self, existed):
+        """Test delete_snapshot with and without the backend snapshot."""
         volume = self._create_volume()
         snapshot = self._create_snapshot(volume=volume)
-
-        self.mock_client.get_snapshot.return_value = {'id': 'snap-001'}
+        self.mock_client.delete_snapshot_if_exists.return_value = existed
 
         self.driver.delete_snapshot(snapshot)
 
-        self.mock_client.delete_snapshot.assert_called_once()
-
-    def test_delete_snapshot_not_found(self):
-        """Test delete_snapshot when snapshot not found."""
-        volume = self._create_volume()
-        snapshot = self._create_snapshot(volume=volume)
-
-        self.mock_client.get_snapshot.return_value = None
-
-        # Should not raise exception
-        self.driver.delete_snapshot(snapshot)
-
-        self.mock_client.delete_snapshot.assert_not_called()
+        self.assertEqual(
+            [mock.call.delete_snapshot_if_exists(
+                f'volume-{volume.id}', f'snapshot-{snapshot.id}')],
+            self.mock_client.mock_calls)
 
     # ========== Clone Tests ==========
 
@@ -485,9 +682,90 @@ class QSANISCSIDriverTestCase(test.TestCase):
 
         self.driver.create_cloned_volume(new_volume, src_volume)
 
-        self.mock_client.clone_volume.assert_called_once()
-        self.mock_client.extend_volume.assert_called_once_with(
-            f'volume-{new_volume.id}', 20)
+        self.mock_client.clone_volume.assert_called_once_with(
+            f'volume-{src_volume.id}', f'volume-{new_volume.id}', size_gb=20)
+        self.mock_client.extend_volume.assert_not_called()
+
+    def test_create_volumes_from_snapshot_bulk(self):
+        """Test bulk creation reports each volume's outcome in order."""
+        snapshot = self._create_snapshot()
+        volumes = [self._create_volume(volume_id=fake.VOLUME2_ID),
+                   self._create_volume(volume_id=fake.VOLUME3_ID)]
+        self.mock_client.create_volume_from_snapshot.side_effect = [
+            None, common.QSANApiException(message='Pool full')]
+
+        with self.assertLogs(qsan_iscsi.LOG.logger, 'ERROR'):
+            result = self.driver.create_volumes_from_snapshot_bulk(
+                [(volume, snapshot) for volume in volumes])
+
+        self.assertEqual([volumes[0], volumes[1]],
+                         [volume for volume, _error in result])
+        self.assertIsNone(result[0][1])
+        self.assertIsInstance(result[1][1],
+                              exception.VolumeBackendAPIException)
+
+    def test_create_volumes_from_snapshot_bulk_bounded(self):
+        """Test bulk work never runs more than the configured workers."""
+        self._create_driver(qsan_io_pool_workers=2)
+        snapshot = self._create_snapshot()
+        volumes = [self._create_volume(volume_id=volume_id)
+                   for volume_id in (fake.VOLUME2_ID, fake.VOLUME3_ID,
+                                     fake.VOLUME4_ID)]
+        running = []
+        peak = []
+
+        def create(*args, **kwargs):
+            running.append(args)
+            peak.append(len(running))
+            eventlet.sleep(0)
+            running.pop()
+
+        self.mock_client.create_volume_from_snapshot.side_effect = create
+
+        self.driver.create_volumes_from_snapshot_bulk(
+            [(volume, snapshot) for volume in volumes])
+
+        self.assertEqual(2, self.driver._io_pool.size)
+        self.assertEqual(2, max(peak))
+        self.assertEqual(3, len(peak))
+
+    @mock.patch.object(qsan_iscsi.volume_utils,
+                       'is_group_a_cg_snapshot_type', return_value=False)
+    def test_create_group_from_src(self, mock_is_cg):
+        """Test a group is created from its snapshots in bulk."""
+        snapshot = self._create_snapshot()
+        volumes = [self._create_volume(volume_id=fake.VOLUME2_ID),
+                   self._create_volume(volume_id=fake.VOLUME3_ID)]
+        self.mock_client.create_volume_from_snapshot.side_effect = [
+            None, common.QSANApiException(message='Pool full')]
+
+        with self.assertLogs(qsan_iscsi.LOG.logger, 'ERROR'):
+            model_update, volumes_model_update = (
+                self.driver.create_group_from_src(
+                    mock.sentinel.context, mock.sentinel.group, volumes,
+                    snapshots=[snapshot, snapshot]))
+
+        self.assertEqual({'status': 'error'}, model_update)
+        self.assertEqual([{'id': fake.VOLUME2_ID, 'status': 'available'},
+                          {'id': fake.VOLUME3_ID, 'status': 'error'}],
+                         volumes_model_update)
+
+    @ddt.data((True, [mock.sentinel.snapshot], None),
+              (False, None, [mock.sentinel.source_vol]))
+    @ddt.unpack
+    def test_create_group_from_src_not_implemented(self, is_cg, snapshots,
+                                                   source_vols):
+        """Test consistency groups and source groups stay generic."""
+        with mock.patch.object(qsan_iscsi.volume_utils,
+                               'is_group_a_cg_snapshot_type',
+                               return_value=is_cg):
+            self.assertRaises(NotImplementedError,
+                              self.driver.create_group_from_src,
+                              mock.sentinel.context, mock.sentinel.group,
+                              [mock.sentinel.volume], snapshots=snapshots,
+                              source_vols=source_vols)
+
+        self.mock_client.create_volume_from_snapshot.assert_not_called()
 
     # ========== Migration Tests ==========
 
@@ -497,7 +775,7 @@ class QSANISCSIDriverTestCase(test.TestCase):
         host = {'host': 'new_host'}
 
         moved, model_update = self.driver.migrate_volume(
-            self.context, volume, host)
+            mock.sentinel.context, volume, host)
 
         self.assertFalse(moved)
         self.assertIsNone(model_update)
@@ -536,9 +814,28 @@ class QSANISCSIDriverTestCase(test.TestCase):
         self.assertEqual(2, len(result))
         self.assertIn('3260', result[0])
 
+    def test_get_iscsi_portals_cached(self):
+        """Test the configured portals are normalized once."""
+        first = self.driver._get_iscsi_portals()
+        first.append(mock.sentinel.extra_portal)
+        self.driver.configuration.qsan_iscsi_portals = []
+
+        self.assertEqual(2, len(self.driver._get_iscsi_portals()))
+        self.assertEqual(f'{FAKE_ISCSI_PORTAL_1}:3260;'
+                         f'{FAKE_ISCSI_PORTAL_2}:3260',
+                         self.driver._get_portal_str())
+
+    def test_get_iscsi_portals_ipv6(self):
+        """Test the default port is added to bracketed IPv6 portals."""
+        self._create_driver(
+            qsan_iscsi_portals=['[2001:db8::1]', '[2001:db8::2]:3261'])
+
+        self.assertEqual(['[2001:db8::1]:3260', '[2001:db8::2]:3261'],
+                         self.driver._get_iscsi_portals())
+
     def test_get_iscsi_portals_fallback_to_management_ip(self):
         """Test _get_iscsi_portals falls back to management IP."""
-        self.configuration.qsan_iscsi_portals = []
+        self._create_driver(qsan_iscsi_portals=[])
 
         result = self.driver._get_iscsi_portals()
 
@@ -551,14 +848,15 @@ class QSANISCSIDriverTestCase(test.TestCase):
         """Test terminate."""
         self.driver.terminate()
 
-        self.mock_client.logout.assert_called_once()
+        self.assertEqual([mock.call.close()], self.mock_client.mock_calls)
 
     def test_terminate_logout_error(self):
         """Test terminate handles logout error gracefully."""
-        self.mock_client.logout.side_effect = Exception('Logout failed')
+        self.mock_client.close.side_effect = Exception('Logout failed')
 
-        # Should not raise exception
-        self.driver.terminate()
+        # Should not raise exception, only log a warning
+        with self.assertLogs(qsan_iscsi.LOG.logger, 'WARNING'):
+            self.driver.terminate()
 
     # ========== Driver Options Tests ==========
 
@@ -568,3 +866,30 @@ class QSANISCSIDriverTestCase(test.TestCase):
 
         self.assertIsInstance(options, list)
         self.assertGreater(len(options), 0)
+
+    @ddt.data('192.168.1.101', '192.168.1.101:3261,192.168.1.102',
+              'portal.example.com', '[2001:db8::1]:3260',
+              '[2001:db8::1],[::ffff:192.0.2.1]:3261')
+    def test_iscsi_portals_option(self, value):
+        """Test well-formed portal lists are accepted at load time."""
+        opt_type = options.qsan_iscsi_opts[0].type
+
+        self.assertEqual(value.split(','), opt_type(value))
+
+    @ddt.data('192.168.1.101 3260', '192.168.1.101;192.168.1.102',
+              '192.168.1.101:port', '[2001:db8::1', '[portal]:3260')
+    def test_iscsi_portals_option_invalid(self, value):
+        """Test malformed portals are rejected when the config is parsed."""
+        opt_type = options.qsan_iscsi_opts[0].type
+
+        self.assertRaises(ValueError, opt_type, value)
+
+    def test_get_driver_options_cached(self):
+        """Test get_driver_options builds the list once."""
+        first = qsan_iscsi.QSANISCSIDriver.get_driver_options()
+        first.append(mock.sentinel.extra_opt)
+
+        second = qsan_iscsi.QSANISCSIDriver.get_driver_options()
+
+        self.assertNotIn(mock.sentinel.extra_opt, second)
+        self.assertEqual(first[:-1], second)
@@ -14,11 +14,19 @@
 #    under the License.
 """Common utilities for QSAN drivers."""
 
+import copy
+import gzip
+import random
+import socket
+import threading
 import time
 
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
 from oslo_utils import units
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import retry as urllib3_retry
 
 from cinder import exception
 from cinder.i18n import _
@@ -26,12 +34,199 @@ from cinder.i18n import _
 
 LOG = logging.getLogger(__name__)
 
+# Connection pool sizing for the management REST endpoint. The volume
+# manager runs operations concurrently, so keep enough keep-alive sockets
+# around that back-to-back calls do not pay a new TCP/TLS handshake.
+_POOL_CONNECTIONS = 16
+_POOL_MAXSIZE = 32
+
+# Separate connection pools, keyed by endpoint root, so that a slow API
+# family only holds on to its own sockets. Everything else shares the
+# default pool above.
+_POOL_BULKHEADS = (
+    ('volumes', 24),
+    ('targets', 16),
+    ('system', 4),
+    ('system_info', 4),
+)
+
+# Probe idle pooled connections so that a firewall dropping them between
+# provisioning bursts is noticed before the next request is sent on them.
+_SOCKET_OPTIONS = [
+    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60),
+    (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 30),
+    (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3),
+]
+
+# First retry delay in seconds; doubled on every further attempt.
+_RETRY_BASE_DELAY = 1.0
+
+# Seconds that slowly changing controller data is served from memory.
+_SYSTEM_INFO_TTL = 300
+_POOL_TTL = 30
+_PORTALS_TTL = 30
+
+# Seconds that the last good pool or system reply is still returned when
+# the controller cannot be reached, so stats reporting rides out blips.
+_STALE_TTL = 300
+
+_MISSING = object()
+
+# Request bodies larger than this many bytes are gzip-compressed when
+# compression is enabled; smaller ones are not worth the CPU.
+_GZIP_MIN_SIZE = 1024
+_GZIP_HEADERS = {'Content-Encoding': 'gzip'}
+
+# Replies that mean the controller is busy or failing rather than that the
+# request was wrong; these are retried by the transport adapter.
+_RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# Replies from firmware that rejects a request body field it does not know.
+_UNKNOWN_FIELD_STATUSES = frozenset([400, 422])
+
+# Methods re-sent after a fresh login when the token has expired. PATCH is
+# only used to set an absolute size, so it is safe to repeat; POST is left
+# out, as repeating it could create an object twice.
+_RELOGIN_METHODS = frozenset(['GET', 'PUT', 'PATCH', 'DELETE'])
+
 
 class QSANApiException(exception.VolumeDriverException):
     """Exception for QSAN API errors."""
     message = _("QSAN API error: %(message)s")
 
 
+class _JitteredRetry(urllib3_retry.Retry):
+    """urllib3 Retry with a capped exponential backoff plus jitter.
+
+    The delay after the n-th consecutive failure is
+    ``min(backoff_cap, 2 ** (n - 1))`` seconds, stretched by a random
+    fraction of up to ``jitter`` so that concurrent workers do not retry
+    in lockstep. A Retry-After header from the controller is honoured, but
+    capped at ``backoff_cap`` as well.
+    """
+
+    backoff_cap = 30
+    jitter = 0.5
+
+    def new(self, **kw):
+        retry = super(_JitteredRetry, self).new(**kw)
+        retry.backoff_cap = self.backoff_cap
+        retry.jitter = self.jitter
+        return retry
+
+    def get_backoff_time(self):
+        failures = len(self.history)
+        if not failures:
+            return 0
+        delay = min(self.backoff_cap, _RETRY_BASE_DELAY * 2 ** (failures - 1))
+        return delay * (1 + random.random() * self.jitter)
+
+    def get_retry_after(self, response):
+        retry_after = super(_JitteredRetry, self).get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, self.backoff_cap)
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter whose pooled sockets send TCP keepalive probes."""
+
+    socket_options = _SOCKET_OPTIONS
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self.socket_options
+        super(_KeepAliveAdapter, self).init_poolmanager(*args, **kwargs)
+
+
+class _CircuitBreaker:
+    """Stop calling a QSAN controller that keeps failing.
+
+    After ``threshold`` consecutive failed requests the breaker opens and
+    every request is rejected immediately for ``reset_timeout`` seconds.
+    The first request after that is let through as a probe: success closes
+    the breaker again, failure re-opens it for another period. A probe
+    that never reports back expires after ``reset_timeout`` as well.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._lock = threading.Lock()
+
+    def before(self):
+        """Check a request may be sent.
+
+        :raises QSANApiException: If the breaker is open
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if now - self._opened_at >= self.reset_timeout:
+                # Restart the clock so one probe is in flight at a time.
+                self.state = self.HALF_OPEN
+                self._opened_at = now
+                return
+        msg = _("QSAN API is unavailable after %d consecutive failures, "
+                "not sending request.") % self._failures
+        raise QSANApiException(message=msg)
+
+    def record_success(self):
+        """Close the breaker after a request reached the controller."""
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        """Count a failed request, opening the breaker if needed."""
+        with self._lock:
+            self._failures += 1
+            if (self.state == self.HALF_OPEN or
+                    self._failures >= self.threshold):
+                if self.state != self.OPEN:
+                    LOG.warning("QSAN API circuit breaker opened after %d "
+                                "consecutive failures.", self._failures)
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class _TTLCache:
+    """Thread-safe dictionary whose entries expire after a given time."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the live value for key, or _MISSING."""
+        with self._lock:
+            expires, value = self._data.get(key, (0, _MISSING))
+            if expires <= time.monotonic():
+                self._data.pop(key, None)
+                return _MISSING
+            return value
+
+    def set(self, key, value, ttl):
+        """Store value under key for ttl seconds."""
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+
+    def invalidate(self, prefix=''):
+        """Drop every entry whose key starts with prefix."""
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+
 class QSANClient:
     """REST API client for QSAN storage systems.
 
@@ -40,7 +235,10 @@ class QSANClient:
     """
 
     def __init__(self, host, port, protocol, username, password,
-                 ssl_verify=True, timeout=60, retry_count=3):
+                 ssl_verify=True, timeout=60, retry_count=3,
+                 backoff_cap=30, jitter=0.5, connect_timeout=5,
+                 breaker_threshold=5, breaker_reset=30,
+                 compress_requests=False, pool_maxsize=_POOL_MAXSIZE):
         """Initialize the QSAN REST API client.
 
         :param host: Management IP address of the QSAN storage
@@ -51,6 +249,16 @@ class QSANClient:
         :param ssl_verify: Whether to verify SSL certificates
         :param timeout: API call timeout in seconds
         :param retry_count: Number of times to retry failed calls
+        :param backoff_cap: Upper bound in seconds of the retry delay
+        :param jitter: Random fraction added on top of each retry delay
+        :param connect_timeout: Timeout in seconds to establish a connection
+        :param breaker_threshold: Consecutive failed calls before further
+                                  calls are rejected without being sent
+        :param breaker_reset: Seconds to reject calls before trying again
+        :param compress_requests: Whether to gzip large request bodies
+        :param pool_maxsize: Most connections kept open to the controller;
+                             endpoint families with a smaller pool of their
+                             own are capped at this size too
         """
         self.host = host
         self.port = port
@@ -59,16 +267,58 @@ class QSANClient:
         self.password = password
         self.ssl_verify = ssl_verify
         self.timeout = timeout
+        self.connect_timeout = connect_timeout
         self.retry_count = retry_count
+        self.backoff_cap = backoff_cap
+        self.jitter = jitter
+        self.compress_requests = compress_requests
+        self.pool_maxsize = pool_maxsize
 
         self.base_url = f"{protocol}://{host}:{port}"
+        # Endpoint roots, built once; methods append object names to them.
+        self._urls = {
+            key: self.base_url + path for key, path in (
+                ('auth_get', '/auth/get'),
+                ('auth_revoke', '/auth/revoke'),
+                ('volumes', '/rest/v2/storage/block/volumes'),
+                ('snapshot_targets', '/rest/v2/backup/snapshot/targets'),
+                ('pools', '/rest/v2/storage/pools'),
+                ('targets', '/rest/v2/dataTransfer/targets'),
+                ('ethernet', '/rest/v2/network/ethernet'),
+                ('system', '/api/system'),
+                ('system_info', '/rest/v2/system/info'),
+            )
+        }
         self.session = None
         self.session_token = None
+        self._breaker = _CircuitBreaker(breaker_threshold, breaker_reset)
+        self._cache = _TTLCache()
+        # Last successful reply per cache key, as (time fetched, value).
+        self._last_good = {}
+        # Target name to id; targets are only renamed by deleting them.
+        self._target_ids = {}
+        self._target_lock = threading.Lock()
 
     def _create_session(self):
         """Create a new HTTP session."""
         self.session = requests.Session()
         self.session.verify = self.ssl_verify
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+        adapter = self._create_adapter(self.pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        for key, pool_maxsize in _POOL_BULKHEADS:
+            self.session.mount(
+                self._urls[key],
+                self._create_adapter(min(pool_maxsize, self.pool_maxsize)))
+
+    def _create_adapter(self, pool_maxsize):
+        """Create a keepalive, retrying adapter with its own pool."""
+        return _KeepAliveAdapter(pool_connections=_POOL_CONNECTIONS,
+                                 pool_maxsize=pool_maxsize,
+                                 pool_block=False,
+                                 max_retries=self._build_retry())
 
     def login(self):
         """Authenticate with the QSAN storage system.
@@ -80,7 +330,7 @@ class QSANClient:
         if self.session is None:
             self._create_session()
 
-        url = f"{self.base_url}/auth/get"
+        url = self._urls['auth_get']
         data = {
             'user': self.username,
             'password': self.password,
@@ -91,12 +341,14 @@ class QSANClient:
             response = self.session.post(
                 url,
                 json=data,
-                timeout=self.timeout
+                timeout=(self.connect_timeout, self.timeout)
             )
             response.raise_for_status()
             result = response.json()
             # Token may be returned as 'token' or 'accessToken'
             self.session_token = result.get('token') or result.get('accessToken')
+            self.session.headers['Authorization'] = (
+                f"Bearer {self.session_token}")
             LOG.debug("Successfully logged in to QSAN storage at %s",
                       self.host)
         except requests.exceptions.RequestException as e:
@@ -107,12 +359,13 @@ class QSANClient:
     def logout(self):
         """Logout from the QSAN storage system.
 
-        Uses /auth/revoke endpoint as per API_REFERENCE.md.
+        Uses /auth/revoke endpoint as per API_REFERENCE.md. The HTTP
+        session stays open so that a later login can reuse its connections.
         """
         if self.session is None or self.session_token is None:
             return
 
-        url = f"{self.base_url}/auth/revoke"
+        url = self._urls['auth_revoke']
         try:
             self._request('POST', url, data={'refreshToken': self.session_token})
             LOG.debug("Successfully logged out from QSAN storage at %s",
@@ -120,47 +373,158 @@ class QSANClient:
         except Exception:
             LOG.warning("Failed to logout from QSAN storage, ignoring.")
         finally:
+            # Keep the session and its pooled connections for the next
+            # login; only the credentials are dropped.
             self.session_token = None
+            self.session.headers.pop('Authorization', None)
+
+    def close(self):
+        """Log out and release the pooled connections of the session."""
+        self.logout()
+        if self.session is not None:
+            self.session.close()
             self.session = None
 
-    def _request(self, method, url, data=None, params=None):
+    def __enter__(self):
+        self.login()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # Last resort for clients that were never closed; only the sockets
+        # are released, as no API call should be made during teardown.
+        try:
+            if self.session is not None:
+                self.session.close()
+        except Exception:
+            pass
+
+    def _build_retry(self):
+        """Build the retry policy applied by the transport adapter.
+
+        Connection errors, timeouts, 429 and 5xx replies are retried up to
+        retry_count attempts in total; the final reply is handed back rather
+        than raised so that its status reaches the caller. A POST that may
+        have reached the controller is not replayed, as it could create an
+        object twice; failing to connect is still retried for every method.
+        """
+        retry = _JitteredRetry(
+            total=self.retry_count - 1,
+            status_forcelist=_RETRY_STATUSES,
+            allowed_methods=_RELOGIN_METHODS,
+            raise_on_status=False,
+            respect_retry_after_header=True)
+        retry.backoff_cap = self.backoff_cap
+        retry.jitter = self.jitter
+        return retry
+
+    @staticmethod
+    def _is_retryable(error):
+        """Whether a failed request may succeed if sent again.
+
+        Connection problems, timeouts, 5xx and 429 responses are transient;
+        any other 4xx response means the request itself was rejected.
+        """
+        response = getattr(error, 'response', None)
+        if response is None:
+            return True
+        status = response.status_code
+        return status == 429 or not 400 <= status < 500
+
+    def _request(self, method, url, data=None, params=None,
+                 missing_ok=False):
         """Make an HTTP request to the QSAN API.
 
         :param method: HTTP method (GET, POST, PUT, DELETE)
         :param url: URL to request
         :param data: Request body data
         :param params: Query parameters
+        :param missing_ok: Return _MISSING instead of raising on 404
         :returns: Response JSON data
         :raises QSANApiException: If the request fails
         """
-        headers = {
-            'Content-Type': 'application/json',
-        }
-        if self.session_token:
-            headers['Authorization'] = f"Bearer {self.session_token}"
-
-        for attempt in range(self.retry_count):
-            try:
-                response = self.session.request(
-                    method,
-                    url,
-                    json=data,
-                    params=params,
-                    headers=headers,
-                    timeout=self.timeout
-                )
-                response.raise_for_status()
-                if response.content:
-                    return response.json()
-                return None
-            except requests.exceptions.RequestException as e:
-                if attempt < self.retry_count - 1:
-                    LOG.warning("API request failed, retrying: %s", str(e))
-                    time.sleep(1)
-                    continue
-                msg = _("QSAN API request failed: %s") % str(e)
-                LOG.error(msg)
-                raise QSANApiException(message=msg)
+        self._breaker.before()
+        # Serialize once rather than on every retry; the session already
+        # sends the JSON Content-Type header.
+        body = jsonutils.dumps(data) if data is not None else None
+        headers = None
+        if (self.compress_requests and body is not None and
+                len(body) > _GZIP_MIN_SIZE):
+            body = gzip.compress(body.encode('utf-8'))
+            headers = _GZIP_HEADERS
+        try:
+            response = self._send(method, url, body, params, headers)
+            # An expired token is refreshed once for requests that are safe
+            # to send again.
+            if response.status_code == 401 and method in _RELOGIN_METHODS:
+                LOG.info("QSAN session token was rejected, logging in again.")
+                self.login()
+                response = self._send(method, url, body, params, headers)
+            if missing_ok and response.status_code == 404:
+                self._breaker.record_success()
+                return _MISSING
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            # A rejected request still proves the controller is up.
+            if self._is_retryable(e):
+                self._breaker.record_failure()
+            else:
+                self._breaker.record_success()
+            msg = _("QSAN API request failed: %s") % str(e)
+            LOG.error(msg)
+            if getattr(e, 'response', None) is not None:
+                raise QSANApiException(message=msg,
+                                       code=e.response.status_code)
+            raise QSANApiException(message=msg)
+        except Exception:
+            # A failed re-login or any other error must still settle the
+            # breaker, or a half-open probe would never finish.
+            self._breaker.record_failure()
+            raise
+
+        self._breaker.record_success()
+        if response.content:
+            return response.json()
+        return None
+
+    def _send(self, method, url, body, params, headers):
+        """Send one request; retries happen inside the session adapter."""
+        return self.session.request(
+            method,
+            url,
+            data=body,
+            params=params,
+            headers=headers,
+            timeout=(self.connect_timeout, self.timeout)
+        )
+
+    def _cached_get(self, key, url, ttl):
+        """GET url, reusing a reply fetched less than ttl seconds ago.
+
+        If the request fails, a reply fetched less than _STALE_TTL seconds
+        ago is returned instead of raising.
+        """
+        result = self._cache.get(key)
+        if result is not _MISSING:
+            return copy.deepcopy(result)
+        try:
+            result = self._request('GET', url)
+        except QSANApiException:
+            fetched, result = self._last_good.get(key, (None, None))
+            age = (time.monotonic() - fetched if fetched is not None
+                   else None)
+            if age is None or age >= _STALE_TTL:
+                raise
+            LOG.warning("Serving stale %(key)s data from QSAN storage at "
+                        "%(host)s, age=%(age)ds.",
+                        {'key': key, 'host': self.host, 'age': age})
+            return copy.deepcopy(result)
+        self._cache.set(key, result, ttl)
+        self._last_good[key] = (time.monotonic(), result)
+        # Callers get their own copy so they cannot alter the cached reply.
+        return copy.deepcopy(result)
 
     # ========== Volume Operations ==========
 
@@ -175,14 +539,17 @@ class QSANClient:
         :param thin: Whether to create a thin-provisioned volume
         :returns: Volume information dictionary
         """
-        url = f"{self.base_url}/rest/v2/storage/block/volumes"
+        url = self._urls['volumes']
         data = {
             'poolId': pool_name,
             'name': volume_name,
             'totalSize': size_gb * units.Gi // units.Mi,  # API expects MB
             'type': 'THIN' if thin else 'RAID',
         }
-        return self._request('POST', url, data=data)
+        result = self._request('POST', url, data=data)
+        # Pool capacity changed; do not report the cached figures.
+        self._cache.invalidate('pool:')
+        return result
 
     def delete_volume(self, volume_name):
         """Delete a volume from the QSAN storage.
@@ -191,8 +558,21 @@ class QSANClient:
 
         :param volume_name: Name of the volume to delete
         """
-        url = f"{self.base_url}/rest/v2/storage/block/volumes/{volume_name}"
-        return self._request('DELETE', url)
+        url = f"{self._urls['volumes']}/{volume_name}"
+        result = self._request('DELETE', url)
+        self._cache.invalidate('pool:')
+        return result
+
+    def delete_volume_if_exists(self, volume_name):
+        """Delete a volume, treating one that does not exist as deleted.
+
+        :param volume_name: Name of the volume to delete
+        :returns: False if the volume did not exist, True otherwise
+        """
+        url = f"{self._urls['volumes']}/{volume_name}"
+        result = self._request('DELETE', url, missing_ok=True)
+        self._cache.invalidate('pool:')
+        return result is not _MISSING
 
     def extend_volume(self, volume_name, new_size_gb):
         """Extend a volume on the QSAN storage.
@@ -202,11 +582,13 @@ class QSANClient:
         :param volume_name: Name of the volume to extend
         :param new_size_gb: New size of the volume in GB
         """
-        url = f"{self.base_url}/rest/v2/storage/block/volumes/{volume_name}"
+        url = f"{self._urls['volumes']}/{volume_name}"
         data = {
             'totalSize': new_size_gb * units.Gi // units.Mi,  # API expects MB
         }
-        return self._request('PATCH', url, data=data)
+        result = self._request('PATCH', url, data=data)
+        self._cache.invalidate('pool:')
+        return result
 
     def get_volume(self, volume_name):
         """Get information about a volume.
@@ -216,7 +598,7 @@ class QSANClient:
         :param volume_name: Name of the volume
         :returns: Volume information dictionary or None if not found
         """
-        url = f"{self.base_url}/rest/v2/storage/block/volumes/{volume_name}"
+        url = f"{self._urls['volumes']}/{volume_name}"
         try:
             return self._request('GET', url)
         except QSANApiException:
@@ -233,11 +615,13 @@ class QSANClient:
         :param snapshot_name: Name for the new snapshot
         :returns: Snapshot information dictionary
         """
-        url = f"{self.base_url}/rest/v2/backup/snapshot/targets/{volume_name}/snapshots"
+        url = f"{self._urls['snapshot_targets']}/{volume_name}/snapshots"
         data = {
             'name': snapshot_name,
         }
-        return self._request('POST', url, data=data)
+        result = self._request('POST', url, data=data)
+        self._cache.invalidate('pool:')
+        return result
 
     def delete_snapshot(self, volume_name, snapshot_name):
         """Delete a snapshot.
@@ -247,8 +631,24 @@ class QSANClient:
         :param volume_name: Name of the source volume
         :param snapshot_name: Name of the snapshot to delete
         """
-        url = f"{self.base_url}/rest/v2/backup/snapshot/targets/{volume_name}/snapshots/{snapshot_name}"
-        return self._request('DELETE', url)
+        url = (f"{self._urls['snapshot_targets']}/{volume_name}"
+               f"/snapshots/{snapshot_name}")
+        result = self._request('DELETE', url)
+        self._cache.invalidate('pool:')
+        return result
+
+    def delete_snapshot_if_exists(self, volume_name, snapshot_name):
+        """Delete a snapshot, treating one that does not exist as deleted.
+
+        :param volume_name: Name of the source volume
+        :param snapshot_name: Name of the snapshot to delete
+        :returns: False if the snapshot did not exist, True otherwise
+        """
+        url = (f"{self._urls['snapshot_targets']}/{volume_name}"
+               f"/snapshots/{snapshot_name}")
+        result = self._request('DELETE', url, missing_ok=True)
+        self._cache.invalidate('pool:')
+        return result is not _MISSING
 
     def get_snapshot(self, volume_name, snapshot_name):
         """Get information about a snapshot.
@@ -259,7 +659,8 @@ class QSANClient:
         :param snapshot_name: Name of the snapshot
         :returns: Snapshot information dictionary or None if not found
         """
-        url = f"{self.base_url}/rest/v2/backup/snapshot/targets/{volume_name}/snapshots/{snapshot_name}"
+        url = (f"{self._urls['snapshot_targets']}/{volume_name}"
+               f"/snapshots/{snapshot_name}")
         try:
             return self._request('GET', url)
         except QSANApiException:
@@ -267,23 +668,49 @@ class QSANClient:
 
     # ========== Clone Operations ==========
 
-    def clone_volume(self, src_volume_name, dst_volume_name, snapshot_name=None):
+    def clone_volume(self, src_volume_name, dst_volume_name,
+                     snapshot_name=None, size_gb=None):
         """Clone a volume.
 
         Uses /rest/v2/storage/block/volumes/:volumeId/clone endpoint.
 
+        The requested size is sent with the clone. Firmware that rejects
+        the size, or does not report the clone at that size, gets a
+        follow-up extend instead.
+
         :param src_volume_name: Name of the source volume
         :param dst_volume_name: Name for the new volume
         :param snapshot_name: Optional snapshot to clone from
+        :param size_gb: Optional size in GB to grow the clone to
         :returns: New volume information dictionary
         """
-        url = f"{self.base_url}/rest/v2/storage/block/volumes/{src_volume_name}/clone"
+        url = f"{self._urls['volumes']}/{src_volume_name}/clone"
         data = {
             'volumeName': dst_volume_name,
         }
         if snapshot_name:
             data['snapshotId'] = snapshot_name
-        return self._request('POST', url, data=data)
+        if not size_gb:
+            result = self._request('POST', url, data=data)
+            self._cache.invalidate('pool:')
+            return result
+
+        size_mb = size_gb * units.Gi // units.Mi  # API expects MB
+        try:
+            result = self._request('POST', url,
+                                   data=dict(data, totalSize=size_mb))
+        except QSANApiException as e:
+            if e.kwargs.get('code') not in _UNKNOWN_FIELD_STATUSES:
+                raise
+            LOG.debug("Clone with size rejected, cloning %s at its source "
+                      "size and extending it.", dst_volume_name)
+            result = self._request('POST', url, data=data)
+        self._cache.invalidate('pool:')
+        reported = (result.get('totalSize') if isinstance(result, dict)
+                    else None)
+        if reported is None or reported < size_mb:
+            self.extend_volume(dst_volume_name, size_gb)
+        return result
 
     def create_volume_from_snapshot(self, snapshot_volume_name, snapshot_name,
                                     new_volume_name, size_gb=None):
@@ -297,12 +724,14 @@ class QSANClient:
         :param size_gb: Optional new size in GB (must be >= snapshot size)
         :returns: New volume information dictionary
         """
-        url = f"{self.base_url}/rest/v2/storage/block/volumes/{snapshot_volume_name}/clone"
+        url = f"{self._urls['volumes']}/{snapshot_volume_name}/clone"
         data = {
             'volumeName': new_volume_name,
             'snapshotId': snapshot_name,
         }
-        return self._request('POST', url, data=data)
+        result = self._request('POST', url, data=data)
+        self._cache.invalidate('pool:')
+        return result
 
     # ========== Pool Operations ==========
 
@@ -314,8 +743,8 @@ class QSANClient:
         :param pool_name: Name of the pool
         :returns: Pool information dictionary
         """
-        url = f"{self.base_url}/rest/v2/storage/pools/{pool_name}"
-        return self._request('GET', url)
+        url = f"{self._urls['pools']}/{pool_name}"
+        return self._cached_get(f'pool:{pool_name}', url, _POOL_TTL)
 
     def get_pool_stats(self, pool_name):
         """Get capacity statistics for a storage pool.
@@ -345,13 +774,17 @@ class QSANClient:
         :param target_iqn: Optional custom IQN, auto-generated if not provided
         :returns: Target information including IQN
         """
-        url = f"{self.base_url}/rest/v2/dataTransfer/targets"
+        url = self._urls['targets']
         data = {
             'name': target_name,
         }
         if target_iqn:
             data['iqn'] = target_iqn
-        return self._request('POST', url, data=data)
+        result = self._request('POST', url, data=data)
+        if result and result.get('id') is not None:
+            with self._target_lock:
+                self._target_ids[target_name] = result['id']
+        return result
 
     def delete_iscsi_target(self, target_id):
         """Delete an iSCSI target.
@@ -360,9 +793,28 @@ class QSANClient:
 
         :param target_id: ID of the target to delete
         """
-        url = f"{self.base_url}/rest/v2/dataTransfer/targets/{target_id}"
+        url = f"{self._urls['targets']}/{target_id}"
+        self._forget_target_id(target_id)
         return self._request('DELETE', url)
 
+    def delete_iscsi_target_if_exists(self, target_id):
+        """Delete an iSCSI target, treating one that does not exist as deleted.
+
+        :param target_id: ID of the target to delete
+        :returns: False if the target did not exist, True otherwise
+        """
+        url = f"{self._urls['targets']}/{target_id}"
+        self._forget_target_id(target_id)
+        result = self._request('DELETE', url, missing_ok=True)
+        return result is not _MISSING
+
+    def _forget_target_id(self, target_id):
+        """Drop every cached name that resolves to target_id."""
+        with self._target_lock:
+            for name, cached_id in list(self._target_ids.items()):
+                if cached_id == target_id:
+                    del self._target_ids[name]
+
     def get_iscsi_target(self, target_id):
         """Get information about an iSCSI target.
 
@@ -371,7 +823,7 @@ class QSANClient:
         :param target_id: ID of the target
         :returns: Target information dictionary
         """
-        url = f"{self.base_url}/rest/v2/dataTransfer/targets/{target_id}"
+        url = f"{self._urls['targets']}/{target_id}"
         return self._request('GET', url)
 
     def get_iscsi_target_by_name(self, target_name):
@@ -382,7 +834,7 @@ class QSANClient:
         :param target_name: Name of the target
         :returns: Target information dictionary or None if not found
         """
-        url = f"{self.base_url}/rest/v2/dataTransfer/targets"
+        url = self._urls['targets']
         try:
             result = self._request('GET', url)
             if result:
@@ -395,6 +847,30 @@ class QSANClient:
         except QSANApiException:
             return None
 
+    def resolve_target_id(self, target_name, refresh=False):
+        """Get the id of an iSCSI target, listing targets only on a miss.
+
+        Ids are cached per client and dropped by delete_iscsi_target, so
+        attach and detach no longer list every target on the array.
+
+        :param target_name: Name of the target
+        :param refresh: Drop the cached id and list the targets again, e.g.
+                        after the cached id was not found on the array
+        :returns: Target id or None if not found
+        """
+        with self._target_lock:
+            if refresh:
+                self._target_ids.pop(target_name, None)
+            target_id = self._target_ids.get(target_name)
+        if target_id is not None:
+            return target_id
+        target = self.get_iscsi_target_by_name(target_name)
+        if target is None or target.get('id') is None:
+            return None
+        with self._target_lock:
+            self._target_ids[target_name] = target['id']
+        return target['id']
+
     def map_volume_to_target(self, volume_name, target_id, lun_id=None):
         """Map a volume to an iSCSI target.
 
@@ -405,7 +881,7 @@ class QSANClient:
         :param lun_id: Optional specific LUN ID, auto-assigned if not provided
         :returns: Mapping information including LUN ID
         """
-        url = f"{self.base_url}/rest/v2/dataTransfer/targets/{target_id}/luns"
+        url = f"{self._urls['targets']}/{target_id}/luns"
         data = {
             'volume': volume_name,
         }
@@ -421,7 +897,7 @@ class QSANClient:
         :param target_id: ID of the target
         :param lun_id: LUN ID to unmap
         """
-        url = f"{self.base_url}/rest/v2/dataTransfer/targets/{target_id}/luns/{lun_id}"
+        url = f"{self._urls['targets']}/{target_id}/luns/{lun_id}"
         return self._request('DELETE', url)
 
     def get_target_luns(self, target_id):
@@ -432,7 +908,7 @@ class QSANClient:
         :param target_id: ID of the target
         :returns: List of LUN mapping dictionaries
         """
-        url = f"{self.base_url}/rest/v2/dataTransfer/targets/{target_id}/luns"
+        url = f"{self._urls['targets']}/{target_id}/luns"
         return self._request('GET', url)
 
     def get_volume_lun_mapping(self, volume_name):
@@ -442,7 +918,7 @@ class QSANClient:
         :returns: Mapping information or None if not mapped
         """
         # This may need to iterate through targets to find the mapping
-        url = f"{self.base_url}/rest/v2/dataTransfer/targets"
+        url = self._urls['targets']
         try:
             result = self._request('GET', url)
             if result:
@@ -471,7 +947,7 @@ class QSANClient:
         :param target_id: ID of the target
         :param initiator_iqn: IQN of the initiator to add
         """
-        url = f"{self.base_url}/rest/v2/dataTransfer/targets/{target_id}/host"
+        url = f"{self._urls['targets']}/{target_id}/host"
         data = {
             'initiator': initiator_iqn,
         }
@@ -483,7 +959,7 @@ class QSANClient:
         :param target_id: ID of the target
         :param initiator_iqn: IQN of the initiator to remove
         """
-        url = f"{self.base_url}/rest/v2/dataTransfer/targets/{target_id}/host"
+        url = f"{self._urls['targets']}/{target_id}/host"
         data = {
             'initiator': initiator_iqn,
             'action': 'remove',
@@ -499,7 +975,7 @@ class QSANClient:
         :param username: CHAP username
         :param password: CHAP password
         """
-        url = f"{self.base_url}/rest/v2/dataTransfer/targets/{target_id}/CHAP"
+        url = f"{self._urls['targets']}/{target_id}/CHAP"
         data = {
             'username': username,
             'password': password,
@@ -513,7 +989,11 @@ class QSANClient:
 
         :returns: List of portal IP addresses
         """
-        url = f"{self.base_url}/rest/v2/network/ethernet"
+        portals = self._cache.get('portals')
+        if portals is not _MISSING:
+            return list(portals)
+
+        url = self._urls['ethernet']
         try:
             result = self._request('GET', url)
             portals = []
@@ -524,7 +1004,8 @@ class QSANClient:
                     ip = ipv4.get('ip')
                     if ip and iface.get('online'):
                         portals.append(ip)
-            return portals
+            self._cache.set('portals', portals, _PORTALS_TTL)
+            return list(portals)
         except QSANApiException:
             return []
 
@@ -535,8 +1016,8 @@ class QSANClient:
 
         :returns: System information dictionary
         """
-        url = f"{self.base_url}/api/system"
-        return self._request('GET', url)
+        url = self._urls['system']
+        return self._cached_get('system', url, _SYSTEM_INFO_TTL)
 
     def get_system_info_v2(self):
         """Get system information from the QSAN storage.
@@ -545,8 +1026,8 @@ class QSANClient:
 
         :returns: System information dictionary
         """
-        url = f"{self.base_url}/rest/v2/system/info"
-        return self._request('GET', url)
+        url = self._urls['system_info']
+        return self._cached_get('system:v2', url, _SYSTEM_INFO_TTL)
 
     def get_system_version(self):
         """Get the firmware version of the QSAN storage.
@@ -15,6 +15,7 @@
 """Configuration options for QSAN drivers."""
 
 from oslo_config import cfg
+from oslo_config import types
 
 from cinder.volume import configuration as conf
 
@@ -53,17 +54,77 @@ qsan_storage_opts = [
                default=60,
                min=10,
                help='Timeout in seconds for QSAN API calls.'),
+    cfg.IntOpt('qsan_connect_timeout',
+               default=5,
+               min=1,
+               help='Timeout in seconds for establishing a connection to '
+                    'the QSAN management interface. Kept short so that an '
+                    'unreachable controller is detected quickly; '
+                    'qsan_api_timeout still bounds the wait for a reply.'),
     cfg.IntOpt('qsan_retry_count',
                default=3,
                min=1,
                help='Number of times to retry failed API calls.'),
+    cfg.IntOpt('qsan_retry_backoff_cap',
+               default=30,
+               min=1,
+               help='Maximum delay in seconds between retries of a failed '
+                    'API call. The delay doubles after every attempt, '
+                    'starting at one second.'),
+    cfg.FloatOpt('qsan_retry_jitter',
+                 default=0.5,
+                 min=0,
+                 help='Random fraction of the retry delay added to each '
+                      'wait, so that concurrent requests do not retry at '
+                      'the same moment.'),
+    cfg.IntOpt('qsan_breaker_threshold',
+               default=5,
+               min=1,
+               help='Number of consecutive failed API calls after which '
+                    'further calls fail immediately without contacting the '
+                    'QSAN storage system.'),
+    cfg.IntOpt('qsan_breaker_reset',
+               default=30,
+               min=1,
+               help='Seconds to fail API calls immediately once '
+                    'qsan_breaker_threshold is reached, before a single '
+                    'call is sent to check whether the storage system has '
+                    'recovered.'),
+    cfg.IntOpt('qsan_stats_refresh_interval',
+               default=0,
+               min=0,
+               help='Seconds between background refreshes of the pool '
+                    'capacity reported to the scheduler. Stats requests, '
+                    'including the periodic refresh of the volume manager, '
+                    'are then answered from memory. 0 fetches the capacity '
+                    'from the QSAN storage on every stats refresh.'),
+    cfg.IntOpt('qsan_pool_maxsize',
+               default=32,
+               min=1,
+               help='Maximum number of connections to the QSAN management '
+                    'interface kept open for reuse.'),
+    cfg.IntOpt('qsan_io_pool_workers',
+               default=8,
+               min=1,
+               help='Maximum number of QSAN API operations that bulk '
+                    'requests, such as creating a group from a snapshot, '
+                    'run at the same time.'),
+    cfg.BoolOpt('qsan_compress_requests',
+                default=False,
+                help='Gzip-compress API request bodies larger than 1 KiB. '
+                     'Only enable this if the QSAN management interface '
+                     'accepts gzip-encoded requests.'),
 ]
 
 # QSAN iSCSI specific options
 qsan_iscsi_opts = [
     cfg.ListOpt('qsan_iscsi_portals',
+                item_type=types.String(
+                    regex=r'^([\w.-]+|\[[0-9A-Fa-f:.]+\])(:\d{1,5})?$'),
                 default=[],
-                help='List of iSCSI portal IPs for the QSAN storage. '
+                help='List of iSCSI portal IPs for the QSAN storage, each '
+                     'optionally followed by :port (default 3260). IPv6 '
+                     'addresses must be enclosed in brackets. '
                      'If empty, uses qsan_management_ip.'),
     cfg.BoolOpt('qsan_chap_enabled',
                 default=False,
@@ -76,6 +137,11 @@ qsan_iscsi_opts = [
     cfg.BoolOpt('qsan_thin_provision',
                 default=True,
                 help='Enable thin provisioning for volumes.'),
+    cfg.BoolOpt('qsan_export_on_create',
+                default=False,
+                help='Create the iSCSI target and LUN mapping of a volume '
+                     'when the volume is created, so that its first attach '
+                     'only has to update the target ACL.'),
 ]
 
 # All QSAN options
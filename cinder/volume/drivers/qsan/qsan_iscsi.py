@@ -29,14 +29,20 @@ Configuration example for cinder.conf:
     qsan_chap_enabled = False
 """
 
+import functools
+
+import eventlet
+from eventlet import greenpool
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_service import loopingcall
 from oslo_utils import excutils
 from oslo_utils import units
 
 from cinder import exception
 from cinder.i18n import _
 from cinder import interface
+from cinder.objects import fields
 from cinder.volume import driver
 from cinder.volume.drivers.qsan import common
 from cinder.volume.drivers.qsan import options
@@ -45,9 +51,24 @@ from cinder.volume import volume_utils
 
 LOG = logging.getLogger(__name__)
 
+
 CONF = cfg.CONF
 
 
+@functools.lru_cache(maxsize=1024)
+def _parse_provider_location(provider_location):
+    """Parse a provider_location of the form "portal1;portal2 iqn lun".
+
+    The result is cached, as the same volume is attached many times over
+    its life; it is returned as tuples so the cached value stays intact.
+
+    :returns: Tuple of (portals, target_iqn, target_lun)
+    """
+    location_parts = provider_location.split(' ')
+    portals = tuple(location_parts[0].split(';'))
+    return portals, location_parts[1], int(location_parts[2])
+
+
 @interface.volumedriver
 class QSANISCSIDriver(driver.ISCSIDriver):
     """QSAN iSCSI driver for Cinder.
@@ -77,12 +98,24 @@ class QSANISCSIDriver(driver.ISCSIDriver):
     # Vendor information
     VENDOR = 'QSAN Technology, Inc.'
 
+    _driver_options = None
+
     def __init__(self, *args, **kwargs):
         """Initialize the QSAN iSCSI driver."""
         super(QSANISCSIDriver, self).__init__(*args, **kwargs)
         self.configuration.append_config_values(options.QSAN_OPTS)
         self._qsan_client = None
         self._stats = {}
+        # Portals come from the configuration, which does not change while
+        # the driver runs, so they are normalized on first use only.
+        self._portals = None
+        self._portal_str = None
+        self._stats_loop = None
+        # Shared by bulk operations, so their combined concurrency towards
+        # the storage stays bounded. Once it is full, further work waits in
+        # the caller until a slot frees up instead of queueing.
+        self._io_pool = greenpool.GreenPool(
+            self.configuration.qsan_io_pool_workers)
 
     @classmethod
     def get_driver_options(cls):
@@ -90,10 +123,13 @@ class QSANISCSIDriver(driver.ISCSIDriver):
 
         :returns: List of configuration options
         """
-        additional_opts = cls._get_oslo_driver_opts(
-            'target_ip_address', 'target_protocol', 'target_port',
-            'reserved_percentage', 'max_over_subscription_ratio')
-        return options.QSAN_OPTS + additional_opts
+        # The option set is fixed, so build it once and hand out copies.
+        if cls._driver_options is None:
+            additional_opts = cls._get_oslo_driver_opts(
+                'target_ip_address', 'target_protocol', 'target_port',
+                'reserved_percentage', 'max_over_subscription_ratio')
+            cls._driver_options = options.QSAN_OPTS + additional_opts
+        return list(cls._driver_options)
 
     def do_setup(self, context):
         """Initialize the connection to QSAN storage.
@@ -112,7 +148,14 @@ class QSANISCSIDriver(driver.ISCSIDriver):
             password=self.configuration.qsan_password,
             ssl_verify=self.configuration.qsan_ssl_verify,
             timeout=self.configuration.qsan_api_timeout,
+            connect_timeout=self.configuration.qsan_connect_timeout,
             retry_count=self.configuration.qsan_retry_count,
+            backoff_cap=self.configuration.qsan_retry_backoff_cap,
+            jitter=self.configuration.qsan_retry_jitter,
+            breaker_threshold=self.configuration.qsan_breaker_threshold,
+            breaker_reset=self.configuration.qsan_breaker_reset,
+            compress_requests=self.configuration.qsan_compress_requests,
+            pool_maxsize=self.configuration.qsan_pool_maxsize,
         )
 
         try:
@@ -133,6 +176,12 @@ class QSANISCSIDriver(driver.ISCSIDriver):
             LOG.error(msg)
             raise exception.VolumeDriverException(message=msg)
 
+        interval = self.configuration.qsan_stats_refresh_interval
+        if interval:
+            self._stats_loop = loopingcall.FixedIntervalLoopingCall(
+                self._update_volume_stats)
+            self._stats_loop.start(interval=interval)
+
     def check_for_setup_error(self):
         """Check for setup errors.
 
@@ -193,31 +242,40 @@ class QSANISCSIDriver(driver.ISCSIDriver):
 
         :returns: List of portal IP:port strings
         """
-        configured_portals = self.configuration.qsan_iscsi_portals
-        if configured_portals:
-            portals = configured_portals
-        else:
-            # Fall back to management IP
-            portals = [self.configuration.qsan_management_ip]
-
-        # Add default iSCSI port if not specified
-        portal_list = []
-        for portal in portals:
-            if ':' not in portal:
-                portal = f"{portal}:3260"
-            portal_list.append(portal)
-
-        return portal_list
+        if self._portals is None:
+            configured_portals = self.configuration.qsan_iscsi_portals
+            if configured_portals:
+                portals = configured_portals
+            else:
+                # Fall back to management IP
+                portals = [self.configuration.qsan_management_ip]
+
+            # Add default iSCSI port if not specified; the colons of a
+            # bracketed IPv6 address are not a port.
+            self._portals = [p if ':' in p.rpartition(']')[2] else f"{p}:3260"
+                             for p in portals]
+            self._portal_str = ';'.join(self._portals)
+        return list(self._portals)
+
+    def _get_portal_str(self):
+        """Get the portals in their provider_location form.
+
+        :returns: IP:port strings joined by ';'
+        """
+        if self._portal_str is None:
+            self._get_iscsi_portals()
+        return self._portal_str
 
     # ========== Volume Stats ==========
 
     def get_volume_stats(self, refresh=False):
         """Get volume statistics.
 
-        :param refresh: Whether to refresh stats
+        :param refresh: Whether to refresh stats; ignored while the stats
+                        are refreshed in the background
         :returns: Dictionary of volume stats
         """
-        if refresh or not self._stats:
+        if not self._stats or (refresh and self._stats_loop is None):
             self._update_volume_stats()
         return self._stats
 
@@ -277,6 +335,15 @@ class QSANISCSIDriver(driver.ISCSIDriver):
             LOG.error(msg)
             raise exception.VolumeBackendAPIException(data=msg)
 
+        if self.configuration.qsan_export_on_create:
+            try:
+                return self._create_export(volume_name,
+                                           self._get_target_name(volume))
+            except exception.VolumeBackendAPIException:
+                # The volume is usable; create_export runs again on attach.
+                LOG.warning("Could not pre-export volume %s, it will be "
+                            "exported on attach.", volume_name)
+
         return None
 
     def delete_volume(self, volume):
@@ -289,14 +356,16 @@ class QSANISCSIDriver(driver.ISCSIDriver):
         LOG.info("Deleting volume: %s", volume_name)
 
         try:
-            # Check if volume exists
-            vol_info = self._qsan_client.get_volume(volume_name)
-            if vol_info is None:
+            if self.configuration.qsan_export_on_create:
+                # A volume that was never attached still has the target
+                # made by create_volume, which would otherwise leak.
+                self._call_with_target_id(
+                    self._get_target_name(volume),
+                    self._qsan_client.delete_iscsi_target_if_exists)
+            if not self._qsan_client.delete_volume_if_exists(volume_name):
                 LOG.warning("Volume %s not found, skipping delete.",
                             volume_name)
                 return
-
-            self._qsan_client.delete_volume(volume_name)
             LOG.info("Successfully deleted volume: %s", volume_name)
         except common.QSANApiException as e:
             msg = _("Failed to delete volume %s: %s") % (volume_name, str(e))
@@ -337,6 +406,23 @@ class QSANISCSIDriver(driver.ISCSIDriver):
         volume_name = self._get_volume_name(volume)
         target_name = self._get_target_name(volume)
 
+        # A volume exported by create_volume keeps its target until
+        # remove_export, which also drops the cached target id.
+        if (self.configuration.qsan_export_on_create and
+                volume.provider_location and
+                self._qsan_client.resolve_target_id(target_name) is not None):
+            LOG.debug("Export already exists for volume: %s", volume.id)
+            return None
+
+        return self._create_export(volume_name, target_name)
+
+    def _create_export(self, volume_name, target_name):
+        """Create the iSCSI target of a volume and map the volume to it.
+
+        :param volume_name: QSAN volume name
+        :param target_name: QSAN target name
+        :returns: Dictionary with provider_location and provider_auth
+        """
         LOG.info("Creating iSCSI export for volume: %s", volume_name)
 
         try:
@@ -345,25 +431,31 @@ class QSANISCSIDriver(driver.ISCSIDriver):
             target_id = target_info.get('id')
             target_iqn = target_info.get('iqn')
 
-            # Map volume to target
-            mapping_info = self._qsan_client.map_volume_to_target(
-                volume_name, target_id)
-            lun_id = mapping_info.get('lun_id', 0)
-
-            # Set CHAP authentication if enabled
+            # Set CHAP authentication if enabled. It only needs the
+            # target, so it is sent while the volume is being mapped.
             provider_auth = None
+            chap_thread = None
             if self.configuration.qsan_chap_enabled:
                 chap_user = self.configuration.qsan_chap_username
                 chap_pass = self.configuration.qsan_chap_password
                 if chap_user and chap_pass:
-                    self._qsan_client.set_target_chap(
+                    chap_thread = eventlet.spawn(
+                        self._qsan_client.set_target_chap,
                         target_id, chap_user, chap_pass)
                     provider_auth = f"CHAP {chap_user} {chap_pass}"
 
+            # Map volume to target
+            try:
+                mapping_info = self._qsan_client.map_volume_to_target(
+                    volume_name, target_id)
+            finally:
+                if chap_thread is not None:
+                    chap_thread.wait()
+            lun_id = mapping_info.get('lun_id', 0)
+
             # Build provider_location
-            portals = self._get_iscsi_portals()
-            portal_str = ';'.join(portals)
-            provider_location = f"{portal_str} {target_iqn} {lun_id}"
+            provider_location = (
+                f"{self._get_portal_str()} {target_iqn} {lun_id}")
 
             LOG.info("Created iSCSI export: target=%s, lun=%s",
                      target_iqn, lun_id)
@@ -408,18 +500,13 @@ class QSANISCSIDriver(driver.ISCSIDriver):
         LOG.info("Removing iSCSI export for volume: %s", volume_name)
 
         try:
-            # Find the target
-            target_info = self._qsan_client.get_iscsi_target_by_name(
-                target_name)
-            if target_info is None:
+            # Delete the target (this should also unmap volumes)
+            if not self._call_with_target_id(
+                    target_name,
+                    self._qsan_client.delete_iscsi_target_if_exists):
                 LOG.warning("Target %s not found, skipping removal.",
                             target_name)
                 return
-
-            target_id = target_info.get('id')
-
-            # Delete the target (this should also unmap volumes)
-            self._qsan_client.delete_iscsi_target(target_id)
             LOG.info("Successfully removed export for volume: %s", volume_name)
 
         except common.QSANApiException as e:
@@ -444,19 +531,18 @@ class QSANISCSIDriver(driver.ISCSIDriver):
             # Add initiator to target ACL if available
             if connector and 'initiator' in connector:
                 initiator_iqn = connector['initiator']
-                target_info = self._qsan_client.get_iscsi_target_by_name(
-                    target_name)
-                if target_info:
-                    target_id = target_info.get('id')
-                    try:
-                        self._qsan_client.add_initiator_to_target(
-                            target_id, initiator_iqn)
+                try:
+                    if self._call_with_target_id(
+                            target_name,
+                            functools.partial(
+                                self._qsan_client.add_initiator_to_target,
+                                initiator_iqn=initiator_iqn)):
                         LOG.debug("Added initiator %s to target %s",
                                   initiator_iqn, target_name)
-                    except common.QSANApiException:
-                        # Initiator may already be in ACL
-                        LOG.debug("Initiator %s may already be in ACL",
-                                  initiator_iqn)
+                except common.QSANApiException:
+                    # Initiator may already be in ACL
+                    LOG.debug("Initiator %s may already be in ACL",
+                              initiator_iqn)
 
             # Get iSCSI properties
             iscsi_properties = self._get_iscsi_properties(volume)
@@ -470,6 +556,37 @@ class QSANISCSIDriver(driver.ISCSIDriver):
             with excutils.save_and_reraise_exception():
                 LOG.error("Failed to initialize connection: %s", str(e))
 
+    def _call_with_target_id(self, target_name, call):
+        """Call a client method with the id of a named iSCSI target.
+
+        Target ids are cached by the client, but a target that another
+        host deleted and created again has a new id. If the target is not
+        found under the cached id, the id is resolved again and the call
+        repeated once.
+
+        :param target_name: QSAN target name
+        :param call: Callable taking the target id. It either raises a
+                     404 QSANApiException or returns False if the target
+                     does not exist.
+        :returns: False if the target does not exist, True otherwise
+        """
+        target_id = self._qsan_client.resolve_target_id(target_name)
+        if target_id is None:
+            return False
+        try:
+            if call(target_id) is not False:
+                return True
+        except common.QSANApiException as e:
+            if e.kwargs.get('code') != 404:
+                raise
+        LOG.debug("Target %s not found under id %s, resolving it again.",
+                  target_name, target_id)
+        target_id = self._qsan_client.resolve_target_id(target_name,
+                                                        refresh=True)
+        if target_id is None:
+            return False
+        return call(target_id) is not False
+
     def _get_iscsi_properties(self, volume):
         """Get iSCSI connection properties for a volume.
 
@@ -480,11 +597,8 @@ class QSANISCSIDriver(driver.ISCSIDriver):
             msg = _("Volume %s has no provider_location") % volume.id
             raise exception.VolumeBackendAPIException(data=msg)
 
-        # Parse provider_location: "portal1;portal2 iqn lun"
-        location_parts = volume.provider_location.split(' ')
-        portals = location_parts[0].split(';')
-        target_iqn = location_parts[1]
-        target_lun = int(location_parts[2])
+        portals, target_iqn, target_lun = _parse_provider_location(
+            volume.provider_location)
 
         properties = {
             'target_discovered': False,
@@ -496,7 +610,7 @@ class QSANISCSIDriver(driver.ISCSIDriver):
 
         # Add multipath info if multiple portals
         if len(portals) > 1:
-            properties['target_portals'] = portals
+            properties['target_portals'] = list(portals)
             properties['target_iqns'] = [target_iqn] * len(portals)
             properties['target_luns'] = [target_lun] * len(portals)
 
@@ -524,17 +638,16 @@ class QSANISCSIDriver(driver.ISCSIDriver):
             # Remove initiator from target ACL
             if connector and 'initiator' in connector:
                 initiator_iqn = connector['initiator']
-                target_info = self._qsan_client.get_iscsi_target_by_name(
-                    target_name)
-                if target_info:
-                    target_id = target_info.get('id')
-                    try:
-                        self._qsan_client.remove_initiator_from_target(
-                            target_id, initiator_iqn)
+                try:
+                    if self._call_with_target_id(
+                            target_name,
+                            functools.partial(
+                                self._qsan_client.remove_initiator_from_target,
+                                initiator_iqn=initiator_iqn)):
                         LOG.debug("Removed initiator %s from target %s",
                                   initiator_iqn, target_name)
-                    except common.QSANApiException:
-                        LOG.debug("Failed to remove initiator, may not exist")
+                except common.QSANApiException:
+                    LOG.debug("Failed to remove initiator, may not exist")
 
         except common.QSANApiException as e:
             LOG.warning("Error during terminate_connection: %s", str(e))
@@ -572,15 +685,11 @@ class QSANISCSIDriver(driver.ISCSIDriver):
         LOG.info("Deleting snapshot: %s", snapshot_name)
 
         try:
-            # Check if snapshot exists
-            snap_info = self._qsan_client.get_snapshot(
-                volume_name, snapshot_name)
-            if snap_info is None:
+            if not self._qsan_client.delete_snapshot_if_exists(
+                    volume_name, snapshot_name):
                 LOG.warning("Snapshot %s not found, skipping delete.",
                             snapshot_name)
                 return
-
-            self._qsan_client.delete_snapshot(volume_name, snapshot_name)
             LOG.info("Successfully deleted snapshot: %s", snapshot_name)
         except common.QSANApiException as e:
             msg = _("Failed to delete snapshot %s: %s") % (
@@ -629,13 +738,13 @@ class QSANISCSIDriver(driver.ISCSIDriver):
 
         LOG.info("Cloning volume %s from %s", new_volume_name, src_volume_name)
 
-        try:
-            self._qsan_client.clone_volume(src_volume_name, new_volume_name)
-
-            # Extend if new size is larger
-            if volume.size > src_vref.size:
-                self._qsan_client.extend_volume(new_volume_name, volume.size)
+        # Only ask for a size when growing, so an equal-sized clone never
+        # falls back to an extend on firmware that ignores the size.
+        size_gb = volume.size if volume.size > src_vref.size else None
 
+        try:
+            self._qsan_client.clone_volume(src_volume_name, new_volume_name,
+                                           size_gb=size_gb)
             LOG.info("Successfully cloned volume %s from %s",
                      new_volume_name, src_volume_name)
         except common.QSANApiException as e:
@@ -645,6 +754,58 @@ class QSANISCSIDriver(driver.ISCSIDriver):
 
         return None
 
+    def create_volumes_from_snapshot_bulk(self, pairs):
+        """Create several volumes from snapshots concurrently.
+
+        :param pairs: (volume, snapshot) tuples
+        :returns: List of (volume, error) tuples in the order given, where
+                  error is None if the volume was created
+        """
+        def create(pair):
+            volume, snapshot = pair
+            try:
+                self.create_volume_from_snapshot(volume, snapshot)
+            except exception.VolumeBackendAPIException as e:
+                return volume, e
+            return volume, None
+
+        return list(self._io_pool.imap(create, pairs))
+
+    # ========== Group Operations ==========
+
+    def create_group_from_src(self, context, group, volumes,
+                              group_snapshot=None, snapshots=None,
+                              source_group=None, source_vols=None):
+        """Create a generic group from a group snapshot.
+
+        The volumes are created concurrently instead of one at a time as
+        the generic implementation does. Other sources, and consistency
+        groups, are left to the volume manager.
+
+        :param context: Security context
+        :param group: Group object to be created
+        :param volumes: Volume objects in the group
+        :param group_snapshot: Source group snapshot
+        :param snapshots: Snapshot objects, in the order of volumes
+        :param source_group: Source group
+        :param source_vols: Volume objects in the source group
+        :returns: Tuple of (model_update, volumes_model_update)
+        """
+        if (not snapshots or
+                volume_utils.is_group_a_cg_snapshot_type(group)):
+            raise NotImplementedError()
+
+        model_update = {'status': fields.GroupStatus.AVAILABLE}
+        volumes_model_update = []
+        for volume, error in self.create_volumes_from_snapshot_bulk(
+                zip(volumes, snapshots)):
+            status = fields.VolumeStatus.AVAILABLE
+            if error is not None:
+                status = fields.VolumeStatus.ERROR
+                model_update['status'] = fields.GroupStatus.ERROR
+            volumes_model_update.append({'id': volume.id, 'status': status})
+        return model_update, volumes_model_update
+
     # ========== Migration Operations ==========
 
     def migrate_volume(self, context, volume, host):
@@ -668,8 +829,11 @@ class QSANISCSIDriver(driver.ISCSIDriver):
 
     def terminate(self):
         """Clean up when driver is being stopped."""
+        if self._stats_loop is not None:
+            self._stats_loop.stop()
+            self._stats_loop = None
         if self._qsan_client:
             try:
-                self._qsan_client.logout()
+                self._qsan_client.close()
             except Exception:
                 LOG.warning("Error during QSAN client logout, ignoring.")